@@ -17,7 +17,9 @@ setup(
     "Prompt Engineering"
   ],
   install_requires=[
-    'openai'
+    'openai',
+    'requests',
+    'aiohttp'
   ],
   classifiers=[
     'Development Status :: 4 - Beta',
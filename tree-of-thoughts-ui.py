@@ -1,6 +1,10 @@
 from tree_of_thoughts.treeofthoughts import OpenAILanguageModel, CustomLanguageModel, TreeofThoughts, OptimizedOpenAILanguageModel, OptimizedTreeofThoughts
+from tree_of_thoughts.reporting import StreamlitReporter, set_reporter
 import streamlit as st
 
+# show generated thoughts and intermediary results in the app
+set_reporter(StreamlitReporter())
+
 use_v2 = False
 api_key= st.text_input("Enter your API key")
 api_base= "" # leave it blank if you simply use default openai api url
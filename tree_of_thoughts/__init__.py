@@ -1 +1,17 @@
-from tree_of_thoughts.treeofthoughts import TreeofThoughts, CustomLanguageModel, OptimizedOpenAILanguageModel, OptimizedTreeofThoughts
\ No newline at end of file
+from tree_of_thoughts.treeofthoughts import TreeofThoughts, CustomLanguageModel, OptimizedOpenAILanguageModel, OptimizedTreeofThoughts, AsyncOpenAILanguageModel, depth_aware_heuristic
+from tree_of_thoughts.cache import LRUCache, ResponseCache
+from tree_of_thoughts.ratelimit import RateLimiter, configure_rate_limit
+from tree_of_thoughts.retry import DeadlineExceeded, RetryPolicy
+from tree_of_thoughts.client import OpenAIClient
+from tree_of_thoughts.mock import MockLanguageModel, MockModelError, keyword_scorer
+from tree_of_thoughts.metrics import Metrics, default_metrics, search_scope
+from tree_of_thoughts.nodes import NodeStore, ThoughtNode, state_text
+from tree_of_thoughts.mcts import MonteCarloTreeSearch
+from tree_of_thoughts.transposition import TranspositionTable
+from tree_of_thoughts.dedup import NearDuplicateFilter
+from tree_of_thoughts.events import SearchStopped, search_listener
+from tree_of_thoughts.reporting import LoggingReporter, NullReporter, StreamlitReporter, set_reporter
+from tree_of_thoughts.progress import SearchProgress
+from tree_of_thoughts.checkpoint import Checkpointer
+from tree_of_thoughts.scheduler import FairScheduler
+from tree_of_thoughts.traces import TraceWriter
\ No newline at end of file
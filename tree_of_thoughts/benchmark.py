@@ -0,0 +1,212 @@
+"""
+Benchmark the search engines on MockLanguageModel across a (k, T, b, vth) grid.
+
+    python -m tree_of_thoughts.benchmark --k 2,3 --T 2,3 --b 2 --vth 0.5 --out bench.jsonl
+    python -m tree_of_thoughts.benchmark --out bench.jsonl --save-baseline baseline.json
+    python -m tree_of_thoughts.benchmark --baseline baseline.json
+
+Every run records model calls, simulated tokens, wall time, peak traced memory and the score of
+the returned solution. With --baseline the results are compared against a stored summary and the
+process exits non-zero when a metric regressed past its tolerance.
+"""
+import argparse
+import ast
+import itertools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from tree_of_thoughts.mock import MockLanguageModel
+from tree_of_thoughts.treeofthoughts import OptimizedTreeofThoughts, TreeofThoughts
+
+EXPERIMENTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "experiements")
+EXPERIMENT_FILES = {"v2": "v2.py", "hyperoptimized": "hyperoptimized.py", "v3": "v3"}
+
+# metrics where larger is worse, and where smaller is worse
+COST_METRICS = ("api_calls", "generate_calls", "evaluate_calls", "tokens", "wall_time", "peak_memory")
+QUALITY_METRICS = ("score",)
+
+
+def load_experiment(name):
+    """
+    Pull the search classes out of an experiment script without running it. The scripts build
+    OpenAI models and call solve at module level, so only class definitions are executed.
+    """
+    path = os.path.join(EXPERIMENTS_DIR, EXPERIMENT_FILES[name])
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    body = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom, ast.ClassDef))]
+    namespace = {"__name__": f"experiment_{name}"}
+    exec(compile(ast.Module(body=body, type_ignores=[]), path, "exec"), namespace)
+    return namespace.get("OptimizedTreeofThoughts") or namespace["TreeofThoughts"]
+
+
+def available_engines(include_experiments=True):
+    engines = {"TreeofThoughts": TreeofThoughts, "OptimizedTreeofThoughts": OptimizedTreeofThoughts}
+    if include_experiments and os.path.isdir(EXPERIMENTS_DIR):
+        for name in EXPERIMENT_FILES:
+            try:
+                engines[f"experiements/{name}"] = load_experiment(name)
+            except Exception as e:
+                print(f"Skipping experiment {name}: {type(e).__name__}: {e}", file=sys.stderr)
+    return engines
+
+
+def solution_thoughts(result):
+    # BFS returns a list of thoughts, DFS a (thoughts, value) pair, experiments a list of lists
+    if result is None:
+        return []
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], (int, float)):
+        result = result[0]
+    if isinstance(result, str):
+        return [result]
+    thoughts = []
+    for item in result:
+        thoughts.extend(solution_thoughts(item))
+    return thoughts
+
+
+def run_once(engine_name, engine, algorithm, k, T, b, vth, seed, model_options, timeout):
+    model = MockLanguageModel(seed=seed, **model_options)
+    tree = engine(model, algorithm)
+    record = {"engine": engine_name, "algorithm": algorithm, "k": k, "T": T, "b": b, "vth": vth, "seed": seed}
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        if issubclass(engine, TreeofThoughts):
+            result = tree.solve("benchmark problem", k, T, b, vth, timeout=timeout)
+        else:
+            result = tree.solve("benchmark problem", k, T, b, vth)
+        record["error"] = None
+    except Exception as e:
+        result = None
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["wall_time"] = time.perf_counter() - start
+    record["peak_memory"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    stats = model.stats()
+    thoughts = solution_thoughts(result)
+    record.update({
+        "api_calls": stats.get("api_calls", 0),
+        "generate_calls": stats.get("generate_calls", 0),
+        "evaluate_calls": stats.get("evaluate_calls", 0),
+        "tokens": stats.get("prompt_tokens", 0) + stats.get("completion_tokens", 0),
+        "score": model.quality_scorer(tuple(thoughts)) if thoughts else 0.0,
+        "solved": bool(thoughts),
+    })
+    return record
+
+
+def run_key(record):
+    return f"{record['engine']}|{record['algorithm']}|k={record['k']}|T={record['T']}|b={record['b']}|vth={record['vth']}"
+
+
+def summarize(records):
+    groups = {}
+    for record in records:
+        groups.setdefault(run_key(record), []).append(record)
+    summary = {}
+    for key, group in groups.items():
+        ok = [record for record in group if record["error"] is None]
+        entry = {"runs": len(group), "errors": len(group) - len(ok)}
+        for metric in COST_METRICS + QUALITY_METRICS:
+            values = [record[metric] for record in ok]
+            entry[metric] = sum(values) / len(values) if values else None
+        summary[key] = entry
+    return summary
+
+
+def compare(summary, baseline, tolerance=0.05, time_tolerance=0.5, score_tolerance=0.02):
+    """Return human readable regressions of summary against baseline."""
+    regressions = []
+    for key, base in baseline.items():
+        current = summary.get(key)
+        if current is None:
+            continue
+        if current["errors"] > base.get("errors", 0):
+            regressions.append(f"{key}: errors {base.get('errors', 0)} -> {current['errors']}")
+        for metric in COST_METRICS:
+            old, new = base.get(metric), current.get(metric)
+            if old is None or new is None:
+                continue
+            allowed = time_tolerance if metric == "wall_time" else tolerance
+            if new > old * (1 + allowed) and new - old > 1e-9:
+                regressions.append(f"{key}: {metric} {old:.4g} -> {new:.4g} (+{(new / old - 1) * 100 if old else float('inf'):.1f}%)")
+        for metric in QUALITY_METRICS:
+            old, new = base.get(metric), current.get(metric)
+            if old is not None and new is not None and new < old - score_tolerance:
+                regressions.append(f"{key}: {metric} {old:.4g} -> {new:.4g}")
+    return regressions
+
+
+def parse_list(value, cast):
+    return [cast(item) for item in value.split(",") if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Tree of Thoughts search engines on a deterministic mock model.")
+    parser.add_argument("--k", default="2,3", help="comma separated values of k")
+    parser.add_argument("--T", default="2,3", help="comma separated values of T")
+    parser.add_argument("--b", default="2,3", help="comma separated values of b")
+    parser.add_argument("--vth", default="0.5", help="comma separated values of vth")
+    parser.add_argument("--algorithms", default="BFS,DFS")
+    parser.add_argument("--engines", default=None, help="comma separated engine names, defaults to all that load")
+    parser.add_argument("--no-experiments", action="store_true", help="skip the variants in experiements/")
+    parser.add_argument("--seeds", default="0,1,2")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per model call")
+    parser.add_argument("--evaluation-strategy", default="value", choices=["value", "vote"])
+    parser.add_argument("--timeout", type=float, default=30.0, help="solve timeout for engines that support it")
+    parser.add_argument("--out", default=None, help="write one JSON record per run to this JSONL file")
+    parser.add_argument("--save-baseline", default=None, help="write the summary to this JSON file")
+    parser.add_argument("--baseline", default=None, help="compare the summary against this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="allowed relative growth of calls, tokens and memory")
+    parser.add_argument("--time-tolerance", type=float, default=0.5, help="allowed relative growth of wall time")
+    parser.add_argument("--score-tolerance", type=float, default=0.02, help="allowed absolute drop of the solution score")
+    args = parser.parse_args(argv)
+
+    engines = available_engines(not args.no_experiments)
+    if args.engines:
+        engines = {name: engines[name] for name in args.engines.split(",")}
+    model_options = {"latency": args.latency, "evaluation_strategy": args.evaluation_strategy}
+
+    records = []
+    out = open(args.out, "w") if args.out else None
+    try:
+        grid = itertools.product(engines.items(), args.algorithms.split(","), parse_list(args.k, int), parse_list(args.T, int), parse_list(args.b, int), parse_list(args.vth, float), parse_list(args.seeds, int))
+        for (engine_name, engine), algorithm, k, T, b, vth, seed in grid:
+            record = run_once(engine_name, engine, algorithm, k, T, b, vth, seed, model_options, args.timeout)
+            records.append(record)
+            if out:
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+    finally:
+        if out:
+            out.close()
+
+    summary = summarize(records)
+    for key, entry in sorted(summary.items()):
+        if entry["api_calls"] is None:
+            print(f"{key}: {entry['errors']}/{entry['runs']} runs failed")
+        else:
+            print(f"{key}: calls={entry['api_calls']:.1f} tokens={entry['tokens']:.0f} time={entry['wall_time'] * 1000:.1f}ms mem={entry['peak_memory'] / 1024:.0f}KiB score={entry['score']:.3f} errors={entry['errors']}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(summary, baseline, args.tolerance, args.time_tolerance, args.score_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+import itertools
+import json
+import os
+import time
+
+from tree_of_thoughts.progress import SearchProgress
+
+FORMAT_VERSION = 1
+
+
+def json_args(args):
+    # heuristics and other callables can't be stored, resume() takes them again
+    return {key: value for key, value in args.items() if value is None or isinstance(value, (bool, int, float, str))}
+
+
+class JsonLinesFormat:
+    binary = False
+
+    def dump(self, record):
+        return json.dumps(record, separators=(',', ':')) + '\n'
+
+    def load(self, data):
+        # yields (record, offset of the byte after it)
+        start = 0
+        while True:
+            end = data.find(b'\n', start) + 1
+            if end == 0:
+                # torn last line of a writer that was killed mid-checkpoint
+                return
+            line, start = data[start:end], end
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a line garbled by an older writer, the records after it are still good
+                continue
+            yield record, end
+
+
+class MsgpackFormat:
+    binary = True
+
+    def __init__(self):
+        import msgpack
+        self.msgpack = msgpack
+
+    def dump(self, record):
+        return self.msgpack.packb(record, use_bin_type=True)
+
+    def load(self, data):
+        unpacker = self.msgpack.Unpacker(raw=False, strict_map_key=False)
+        unpacker.feed(data)
+        # a torn last record just ends the iteration; msgpack has no boundary to resync on
+        # after a garbled one, so the records behind it are lost
+        while True:
+            try:
+                record = next(unpacker)
+            except (StopIteration, ValueError):
+                return
+            yield record, unpacker.tell()
+
+
+class Checkpointer:
+    """
+    Append-only checkpoint of a solve: the problem and search arguments, then, every `every`
+    changes or `interval` seconds, the nodes, children, values, final answers, dead ends and
+    counters added since the last write, plus the MCTS statistics that changed and the model's
+    random state when there are any. The random state is written whole, so once the states it
+    superseded make up half the file, the file is rewritten with only the latest one.
+    Records are JSON lines, or msgpack when the path ends in .msgpack (needs the msgpack package).
+
+    solve(..., checkpoint=path) continues from the file when it already holds the same problem,
+    so an interrupted job rerun with the same arguments doesn't pay again for the calls it made.
+    TreeofThoughts.resume(path) does the same from the file alone.
+    """
+
+    def __init__(self, path, every=10, interval=None, format=None):
+        self.path = path
+        self.every = every
+        self.interval = interval
+        if format is None:
+            format = 'msgpack' if str(path).endswith('.msgpack') else 'jsonl'
+        self.format = MsgpackFormat() if format == 'msgpack' else JsonLinesFormat()
+        self.file = None
+        self.header = None
+        # bytes of the file up to the end of its last complete record, and how many of them
+        # belong to random states written over since
+        self.end = 0
+        self.stale = 0
+        self.model = None
+        self.changes = 0
+        self.last_write = time.monotonic()
+        self.reset()
+
+    def reset(self):
+        self.written_nodes = 0
+        self.written_children = 0
+        self.written_values = 0
+        self.written_answers = 0
+        self.written_exhausted = set()
+        self.written_mcts = {}
+        self.written_rng = None
+        self.rng_bytes = 0
+
+    def read(self):
+        """Return the header and the list of records of the file, or (None, []) if there is none."""
+        self.end = 0
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return None, []
+        with open(self.path, 'rb') as f:
+            records = []
+            for record, self.end in self.format.load(f.read()):
+                records.append(record)
+        if not records or records[0].get('type') != 'header':
+            raise ValueError(f"{self.path} is not a tree of thoughts checkpoint")
+        return records[0], records[1:]
+
+    def start(self, x, algorithm, args, model=None):
+        """Open the checkpoint for a solve of x, returning the SearchProgress to continue."""
+        self.model = model
+        header, records = self.read()
+        if header is None:
+            progress = self.restore(x, [])
+            self.open()
+            self.header = {"type": "header", "version": FORMAT_VERSION, "problem": x, "algorithm": algorithm, "args": json_args(args)}
+            self.write([self.header])
+        else:
+            if header["problem"] != x or header["algorithm"] != algorithm:
+                raise ValueError(f"{self.path} holds a checkpoint of another problem or search algorithm")
+            progress = self.restore(x, records)
+            self.header = header
+            self.open()
+        progress.checkpointer = self
+        return progress
+
+    def restore(self, x, records):
+        progress = SearchProgress(x)
+        store = progress.store
+        mcts = None
+        rng = None
+        for record in records:
+            kind = record["type"]
+            if kind == "nodes":
+                for parent, thought in record["nodes"]:
+                    if parent is not None:
+                        store.add(store[parent], thought)
+            elif kind == "children":
+                for index, children in record["children"]:
+                    progress.children[index] = [store[child] for child in children]
+            elif kind == "values":
+                for index, value in record["values"]:
+                    progress.values[index] = value
+            elif kind == "answers":
+                for index, thoughts in record["answers"]:
+                    progress.answers[index] = thoughts
+            elif kind == "exhausted":
+                progress.exhausted.update(record["nodes"])
+            elif kind == "counters":
+                # the interrupted attempt is run again, replaying what it already did for free
+                progress.attempts = max(0, record["attempts"] - 1)
+                progress.work = record["work"]
+            elif kind == "mcts":
+                # each record holds the statistics that changed since the one before
+                mcts = mcts or {}
+                mcts.update((stats[0], stats) for stats in record["stats"])
+                progress.mcts_state = {"iterations": record["iterations"], "stats": list(mcts.values())}
+            elif kind == "rng":
+                rng = record["state"]
+        if rng is not None and self.model is not None and hasattr(self.model, "set_rng_state"):
+            self.model.set_rng_state(rng)
+        self.reset()
+        self.written_nodes = len(store)
+        self.written_children = len(progress.children)
+        self.written_values = len(progress.values)
+        self.written_answers = len(progress.answers)
+        self.written_exhausted = set(progress.exhausted)
+        self.written_mcts = mcts or {}
+        self.written_rng = rng
+        return progress
+
+    def open(self):
+        if self.file is None:
+            # drop a torn tail left by a killed writer, the next record would be glued onto it
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self.end:
+                os.truncate(self.path, self.end)
+            self.file = open(self.path, 'ab')
+
+    def write(self, records, file=None):
+        data = [self.format.dump(record) for record in records]
+        data = [part if self.format.binary else part.encode('utf-8') for part in data]
+        file = file or self.file
+        file.write(b''.join(data))
+        file.flush()
+        os.fsync(file.fileno())
+        self.end += sum(len(part) for part in data)
+        return data
+
+    def changed(self, progress):
+        self.changes += 1
+        if self.changes >= self.every or (self.interval is not None and time.monotonic() - self.last_write >= self.interval):
+            self.save(progress)
+
+    def new_records(self, progress):
+        # everything progress learned since the last write, marked as written
+        records = []
+        store = progress.store
+        if len(store) > self.written_nodes:
+            nodes = [[node.parent, node.thought] for node in store.nodes[self.written_nodes:]]
+            records.append({"type": "nodes", "start": self.written_nodes, "nodes": nodes})
+            self.written_nodes += len(nodes)
+        # children, values and answers are only ever added, so the new entries are at the end of the dicts
+        children = [[index, [child.index for child in kept]] for index, kept in itertools.islice(progress.children.items(), self.written_children, None)]
+        if children:
+            records.append({"type": "children", "children": children})
+            self.written_children += len(children)
+        values = [[index, value] for index, value in itertools.islice(progress.values.items(), self.written_values, None)]
+        if values:
+            records.append({"type": "values", "values": values})
+            self.written_values += len(values)
+        answers = [[index, thoughts] for index, thoughts in itertools.islice(progress.answers.items(), self.written_answers, None)]
+        if answers:
+            records.append({"type": "answers", "answers": answers})
+            self.written_answers += len(answers)
+        exhausted = progress.exhausted - self.written_exhausted
+        if exhausted:
+            records.append({"type": "exhausted", "nodes": sorted(exhausted)})
+            self.written_exhausted |= exhausted
+        records.append({"type": "counters", "attempts": progress.attempts, "work": progress.work})
+        if progress.mcts is not None:
+            snapshot = progress.mcts.snapshot()
+            stats = [stats for stats in snapshot["stats"] if self.written_mcts.get(stats[0]) != stats]
+            records.append({"type": "mcts", "iterations": snapshot["iterations"], "stats": stats})
+            self.written_mcts.update((stats[0], stats) for stats in stats)
+        if self.model is not None and hasattr(self.model, "rng_state"):
+            state = self.model.rng_state()
+            if state != self.written_rng:
+                records.append({"type": "rng", "state": state})
+                self.written_rng = state
+        return records
+
+    def save(self, progress):
+        """Append everything progress learned since the last save."""
+        if self.file is None:
+            return
+        rng_bytes = self.rng_bytes
+        records = self.new_records(progress)
+        data = self.write(records)
+        if records[-1]["type"] == "rng":
+            self.stale += rng_bytes
+            self.rng_bytes = len(data[-1])
+        if self.stale > self.end // 2:
+            self.compact(progress)
+        self.changes = 0
+        self.last_write = time.monotonic()
+
+    def compact(self, progress):
+        """Rewrite the file with a record of each kind, and only the latest random state."""
+        self.file.close()
+        self.file = None
+        self.reset()
+        self.end = 0
+        path = f"{self.path}.tmp"
+        with open(path, 'wb') as f:
+            data = self.write([self.header] + self.new_records(progress), f)
+        if self.written_rng is not None:
+            self.rng_bytes = len(data[-1])
+        # the rename swaps the whole file at once, a kill leaves either the old or the new one
+        os.replace(path, self.path)
+        self.stale = 0
+        self.open()
+
+    def close(self, progress=None):
+        if self.file is None:
+            return
+        if progress is not None:
+            self.save(progress)
+        self.file.close()
+        self.file = None
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+
+
+def default_pool_size():
+    # matches ThreadPoolExecutor's default worker count, so every worker can hold a connection
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+class OpenAIClient:
+    """
+    Connection to one OpenAI-compatible endpoint, owned by a model instance instead of the
+    module-level openai.api_key / openai.api_base globals.
+
+    Blocking calls share a keep-alive requests.Session whose pool holds pool_size connections,
+    so threads reuse TLS connections; async calls use an aiohttp session with the same limit,
+    created per event loop. Errors are raised as the matching openai.error classes.
+
+    Requests go straight to api_base + /completions or /chat/completions, so the openai SDK
+    settings openai.api_type = "azure" and engine= (Azure OpenAI deployments) aren't supported.
+    """
+
+    def __init__(self, api_key, api_base=DEFAULT_API_BASE, organization=None, pool_size=None):
+        self.api_key = api_key
+        self.api_base = (api_base or DEFAULT_API_BASE).rstrip('/')
+        self.organization = organization
+        self.pool_size = pool_size or default_pool_size()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._async_session = None
+        self._async_session_loop = None
+        self._async_session_closer = None
+        self._lock = threading.Lock()
+
+    def headers(self):
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        if self.organization:
+            headers["OpenAI-Organization"] = self.organization
+        return headers
+
+    def url(self, path):
+        return f"{self.api_base}/{path}"
+
+    def request(self, path, params, request_timeout=None):
+        params = {key: value for key, value in params.items() if value is not None}
+        try:
+            response = self.session.post(self.url(path), json=params, headers=self.headers(), timeout=request_timeout)
+        except requests.exceptions.RequestException as e:
+            import openai
+
+            if isinstance(e, requests.exceptions.Timeout):
+                raise openai.error.Timeout(f"Request timed out: {e}") from e
+            raise openai.error.APIConnectionError(f"Error communicating with OpenAI: {e}") from e
+        return self.handle_response(response.status_code, response.text, response.headers)
+
+    def completion(self, request_timeout=None, **params):
+        return self.request("completions", params, request_timeout)
+
+    def chat_completion(self, request_timeout=None, **params):
+        return self.request("chat/completions", params, request_timeout)
+
+    async def get_async_session(self):
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            stale, stale_loop = self._async_session, self._async_session_loop
+            if stale is not None and stale_loop is loop and not stale.closed:
+                return stale
+            session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+            self._async_session = session
+            self._async_session_loop = loop
+        self.close_stale_session(stale, stale_loop)
+        # asyncio.run() finalizes the async generators of its loop before closing it, which
+        # closes the session too, so a loop that ends doesn't leak the pooled connections
+        self._async_session_closer = self.close_with_loop(session)
+        await self._async_session_closer.__anext__()
+        return session
+
+    async def close_with_loop(self, session):
+        try:
+            yield
+        finally:
+            if not session.closed:
+                await session.close()
+
+    def close_stale_session(self, session, loop):
+        # the session of another loop can only be closed on that loop: the close is scheduled on
+        # it while it runs, and a stopped one closes it through close_with_loop when it shuts down
+        if session is None or session.closed or loop is None or loop.is_closed():
+            return
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+
+    async def arequest(self, path, params, request_timeout=None):
+        import aiohttp
+        import openai
+
+        params = {key: value for key, value in params.items() if value is not None}
+        timeout = aiohttp.ClientTimeout(total=request_timeout)
+        try:
+            async with (await self.get_async_session()).post(self.url(path), json=params, headers=self.headers(), timeout=timeout) as response:
+                body = await response.text()
+                return self.handle_response(response.status, body, response.headers)
+        except asyncio.TimeoutError as e:
+            raise openai.error.Timeout("Request timed out") from e
+        except aiohttp.ClientError as e:
+            raise openai.error.APIConnectionError(f"Error communicating with OpenAI: {e}") from e
+
+    async def acompletion(self, request_timeout=None, **params):
+        return await self.arequest("completions", params, request_timeout)
+
+    async def achat_completion(self, request_timeout=None, **params):
+        return await self.arequest("chat/completions", params, request_timeout)
+
+    def handle_response(self, status, body, headers):
+        try:
+            json_body = json.loads(body)
+        except ValueError:
+            json_body = None
+        if 200 <= status < 300 and json_body is not None:
+            return json_body
+        # openai is only needed for its error classes, so it is first imported by a failed call
+        import openai
+
+        headers = dict(headers)
+        error = (json_body or {}).get("error") if isinstance(json_body, dict) else None
+        error = error if isinstance(error, dict) else {}
+        message = error.get("message") or f"HTTP {status}: {body[:200]}"
+        code = error.get("code")
+        if status == 429:
+            raise openai.error.RateLimitError(message, body, status, json_body, headers, code)
+        if status in (400, 404, 409, 415, 422):
+            raise openai.error.InvalidRequestError(message, error.get("param"), code, body, status, json_body, headers)
+        if status == 401:
+            raise openai.error.AuthenticationError(message, body, status, json_body, headers, code)
+        if status == 403:
+            raise openai.error.PermissionError(message, body, status, json_body, headers, code)
+        if status == 503:
+            raise openai.error.ServiceUnavailableError(message, body, status, json_body, headers, code)
+        raise openai.error.APIError(message, body, status, json_body, headers, code)
+
+    async def aclose(self):
+        if self._async_session is not None and not self._async_session.closed:
+            await self._async_session.close()
+        self._async_session = None
+
+    def close(self):
+        self.session.close()
+        if self._async_session is not None and not self._async_session.closed:
+            loop = self._async_session_loop
+            if loop is not None and not loop.is_closed() and not loop.is_running():
+                loop.run_until_complete(self._async_session.close())
+        self._async_session = None
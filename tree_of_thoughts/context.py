@@ -0,0 +1,15 @@
+import contextvars
+
+
+def bind_context(fn):
+    """
+    Wrap fn so it runs in a copy of the caller's contextvars, for work handed to thread pools.
+    Deadlines and metric scopes set around a search then follow its requests into worker threads.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # each call gets its own copy, a Context can only be entered by one thread at a time
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
@@ -0,0 +1,111 @@
+import hashlib
+import random
+
+from tree_of_thoughts.nodes import ThoughtNode, state_text
+from tree_of_thoughts.transposition import normalize_text
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def shingles(text, size=2):
+    words = normalize_text(text).split()
+    if len(words) <= size:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def lsh_bands(num_perm, threshold):
+    """
+    Split num_perm signature rows into bands of equal size so that pairs around the similarity
+    threshold become candidates: the LSH S-curve is steepest near (1 / bands) ** (1 / rows).
+    """
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class MinHash:
+    """Seeded family of num_perm hash functions turning a set of shingles into a signature."""
+
+    def __init__(self, num_perm=64, seed=1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.permutations = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(num_perm)]
+
+    def signature(self, features):
+        hashes = [int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big") for feature in features]
+        if not hashes:
+            return (MAX_HASH,) * self.num_perm
+        return tuple(min(((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes) for a, b in self.permutations)
+
+    @staticmethod
+    def similarity(first, second):
+        # share of equal rows estimates the Jaccard similarity of the two shingle sets
+        return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+
+class NearDuplicateFilter:
+    """
+    Drops candidate thoughts that paraphrase an earlier one, without any model call.
+
+    Thoughts are shingled into word n-grams and MinHashed. An LSH index over signature bands
+    finds the earlier thoughts that may be similar, and a thought is dropped when its estimated
+    Jaccard similarity to one of them reaches threshold.
+    """
+
+    def __init__(self, threshold=0.6, num_perm=64, shingle_size=2, seed=1):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.minhash = MinHash(num_perm, seed)
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        self.dropped = 0
+
+    def signature(self, text):
+        return self.minhash.signature(shingles(text, self.shingle_size))
+
+    def band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def filter(self, texts):
+        """Return the indices of the texts to keep, first occurrence wins."""
+        buckets = {}
+        signatures = []
+        kept = []
+        for index, text in enumerate(texts):
+            signature = self.signature(text)
+            keys = self.band_keys(signature)
+            candidates = {other for key in keys for other in buckets.get(key, ())}
+            signatures.append(signature)
+            if any(MinHash.similarity(signature, signatures[other]) >= self.threshold for other in candidates):
+                self.dropped += 1
+                continue
+            kept.append(index)
+            for key in keys:
+                buckets.setdefault(key, []).append(index)
+        return kept
+
+    def filter_thoughts(self, thoughts):
+        thoughts = list(thoughts)
+        return [thoughts[index] for index in self.filter(thoughts)]
+
+    def filter_states(self, states):
+        """
+        Drop near-duplicate siblings. States are compared on their last thought within each
+        parent, since siblings share the whole path before it.
+        """
+        groups = {}
+        for state in states:
+            parent = state.parent if isinstance(state, ThoughtNode) else None
+            groups.setdefault(parent, []).append(state)
+        keep = set()
+        for group in groups.values():
+            texts = [state.thought if isinstance(state, ThoughtNode) else state_text(state) for state in group]
+            keep.update(id(group[index]) for index in self.filter(texts))
+        return [state for state in states if id(state) in keep]
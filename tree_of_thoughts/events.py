@@ -0,0 +1,64 @@
+import contextlib
+import contextvars
+
+_listener = contextvars.ContextVar("tree_of_thoughts_search_listener", default=None)
+
+
+class SearchStopped(Exception):
+    """Raised inside a search whose consumer stopped listening, to unwind it at the next model call."""
+
+
+@contextlib.contextmanager
+def search_listener(callback, stop=None):
+    """
+    Send the events of every search run inside the block to callback (None sends them nowhere).
+    When the stop threading.Event is set, the search raises SearchStopped before its next model
+    call. Like search_scope, it follows the search into worker threads through bind_context.
+    """
+    token = _listener.set((callback, stop))
+    try:
+        yield
+    finally:
+        _listener.reset(token)
+
+
+@contextlib.contextmanager
+def extra_listener(callback):
+    """Like search_listener, but the listener already installed (and its stop event) keeps getting the events."""
+    previous = _listener.get()
+    if previous is None or previous[0] is None:
+        with search_listener(callback, previous and previous[1]):
+            yield
+        return
+
+    def both(event):
+        callback(event)
+        previous[0](event)
+
+    with search_listener(both, previous[1]):
+        yield
+
+
+@contextlib.contextmanager
+def stop_on(stop):
+    """Stop the searches inside the block like search_listener does, keeping the listener already installed."""
+    previous = _listener.get()
+    with search_listener(previous and previous[0], stop):
+        yield
+
+
+def listening():
+    listener = _listener.get()
+    return listener is not None and listener[0] is not None
+
+
+def emit(type, **fields):
+    listener = _listener.get()
+    if listener is not None and listener[0] is not None:
+        listener[0]({"type": type, **fields})
+
+
+def check_stopped():
+    listener = _listener.get()
+    if listener is not None and listener[1] is not None and listener[1].is_set():
+        raise SearchStopped()
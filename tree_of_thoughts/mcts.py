@@ -0,0 +1,256 @@
+import asyncio
+import concurrent.futures
+import math
+import threading
+import time
+
+from tree_of_thoughts.context import bind_context
+from tree_of_thoughts.progress import SearchProgress
+
+DEFAULT_ITERATIONS = 100
+
+
+class NodeStatistics:
+    __slots__ = ("visits", "value_sum", "virtual_loss", "children", "expanding")
+
+    def __init__(self, visits=0, value_sum=0.0):
+        self.visits = visits
+        self.value_sum = value_sum
+        self.virtual_loss = 0.0
+        # None until expanded, then the kept children (empty when every child was pruned)
+        self.children = None
+        self.expanding = False
+
+    def mean(self):
+        return self.value_sum / self.visits if self.visits else 0.0
+
+
+class MonteCarloTreeSearch:
+    """
+    UCT search driven by a TreeofThoughts, whose generate_thoughts / evaluate_states / merge_states
+    helpers it calls, so transpositions, diversity filtering and metrics apply as in other searches.
+
+    Each iteration walks down from the root picking the child with the best upper confidence
+    bound, expands the leaf with k thoughts and scores all of them in one evaluate_states call;
+    the best child value is the rollout result backed up along the path. Children valued below
+    vth are pruned. Several iterations run at once: every node on a selected path carries a
+    virtual loss until its result is backed up, so concurrent workers spread over different
+    branches instead of all expanding the same one.
+
+    Expansions and scores are recorded on a SearchProgress, so a node expanded before (by an
+    earlier run or a checkpointed one) costs nothing. run() can be called again to continue the
+    same search with more iterations.
+    """
+
+    def __init__(self, tree, k, T, vth=None, exploration=1.4, virtual_loss=1.0, progress=None):
+        self.tree = tree
+        self.k = k
+        self.T = T
+        self.vth = vth
+        self.exploration = exploration
+        self.virtual_loss = virtual_loss
+        self.progress = progress
+        self.stats = {}
+        self.root = None
+        self.iterations = 0
+        self._lock = threading.Condition()
+        self._update_event = None
+
+    def start(self, x):
+        if self.progress is None:
+            self.progress = SearchProgress(x)
+        if self.root is None:
+            self.root = self.progress.root
+            self.stats[self.root.index] = NodeStatistics()
+
+    def uct(self, parent, child):
+        stats = self.stats[child.index]
+        # virtual losses count as visits that scored 0
+        visits = stats.visits + stats.virtual_loss
+        parent_visits = parent.visits + parent.virtual_loss
+        return stats.value_sum / visits + self.exploration * math.sqrt(math.log(max(1.0, parent_visits)) / visits)
+
+    def select(self, wait=True):
+        """
+        Pick a path to a leaf and reserve it with virtual loss. A leaf that another worker is still
+        expanding is no use, so the selection is retried once the tree changed (wait=True) or None
+        is returned.
+        """
+        with self._lock:
+            while True:
+                node = self.root
+                path = [node]
+                while True:
+                    stats = self.stats[node.index]
+                    stats.virtual_loss += self.virtual_loss
+                    if not stats.children or node.depth >= self.T:
+                        break
+                    node = max(stats.children, key=lambda child: self.uct(stats, child))
+                    path.append(node)
+                if not stats.expanding:
+                    break
+                for node in path:
+                    self.stats[node.index].virtual_loss -= self.virtual_loss
+                if not wait:
+                    return None
+                self._lock.wait(0.1)
+            expand = stats.children is None and node.depth < self.T
+            if expand:
+                stats.expanding = True
+            return path, expand
+
+    def notify(self):
+        self._lock.notify_all()
+        if self._update_event is not None:
+            self._update_event.set()
+            self._update_event = asyncio.Event()
+
+    def backpropagate(self, path, children=None, values=None):
+        with self._lock:
+            leaf = self.stats[path[-1].index]
+            if children is not None:
+                kept = [child for child in children if self.vth is None or values[child] >= self.vth]
+                for child in kept:
+                    self.stats.setdefault(child.index, NodeStatistics(1, values[child]))
+                leaf.children = kept
+                leaf.expanding = False
+                value = max((values[child] for child in children), default=leaf.mean())
+            else:
+                # terminal or every child pruned: reuse what is known
+                value = leaf.mean()
+            for node in path:
+                stats = self.stats[node.index]
+                stats.virtual_loss -= self.virtual_loss
+                stats.visits += 1
+                stats.value_sum += value
+            self.iterations += 1
+            self.notify()
+
+    def abandon(self, path, expand):
+        with self._lock:
+            for node in path:
+                self.stats[node.index].virtual_loss -= self.virtual_loss
+            if expand:
+                self.stats[path[-1].index].expanding = False
+            self.notify()
+
+    def expand(self, leaf):
+        t = leaf.depth + 1
+        children = self.progress.expanded(leaf)
+        if children is None:
+            children = self.progress.add_expansions([(leaf, self.tree.generate_thoughts(leaf, self.k, t))], self.tree.merge_states)[leaf]
+        return children, self.progress.scores(children, lambda states: self.tree.evaluate_states(states, t))
+
+    async def aexpand(self, leaf):
+        t = leaf.depth + 1
+        children = self.progress.expanded(leaf)
+        if children is None:
+            children = self.progress.add_expansions([(leaf, await self.tree.agenerate_thoughts(leaf, self.k, t))], self.tree.merge_states)[leaf]
+        return children, await self.progress.ascores(children, lambda states: self.tree.aevaluate_states(states, t))
+
+    def iterate(self):
+        path, expand = self.select()
+        try:
+            if expand:
+                self.backpropagate(path, *self.expand(path[-1]))
+            else:
+                self.backpropagate(path)
+        except BaseException:
+            self.abandon(path, expand)
+            raise
+
+    async def aiterate(self):
+        while True:
+            update = self._update_event
+            selected = self.select(wait=False)
+            if selected is not None:
+                break
+            await update.wait()
+        path, expand = selected
+        try:
+            if expand:
+                self.backpropagate(path, *(await self.aexpand(path[-1])))
+            else:
+                self.backpropagate(path)
+        except BaseException:
+            self.abandon(path, expand)
+            raise
+
+    def budget(self, iterations, time_budget):
+        if iterations is None and time_budget is None:
+            iterations = DEFAULT_ITERATIONS
+        deadline = None if time_budget is None else time.monotonic() + time_budget
+        return lambda started: (iterations is None or started < iterations) and (deadline is None or time.monotonic() < deadline)
+
+    def run(self, x, iterations=None, time_budget=None, max_workers=1, exclude=()):
+        self.start(x)
+        more = self.budget(iterations, time_budget)
+        started = 0
+        if max_workers <= 1:
+            while more(started):
+                self.iterate()
+                started += 1
+            return self.best(exclude)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            try:
+                while True:
+                    while len(pending) < max_workers and more(started):
+                        pending.add(executor.submit(bind_context(self.iterate)))
+                        started += 1
+                    if not pending:
+                        break
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+            finally:
+                for future in pending:
+                    future.cancel()
+        return self.best(exclude)
+
+    async def arun(self, x, iterations=None, time_budget=None, max_workers=1, exclude=()):
+        self.start(x)
+        self._update_event = asyncio.Event()
+        more = self.budget(iterations, time_budget)
+        started = 0
+        pending = set()
+        try:
+            while True:
+                while len(pending) < max(1, max_workers) and more(started):
+                    pending.add(asyncio.ensure_future(self.aiterate()))
+                    started += 1
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+        return self.best(exclude)
+
+    def snapshot(self):
+        with self._lock:
+            stats = [[index, stats.visits, stats.value_sum, None if stats.children is None else [child.index for child in stats.children]] for index, stats in self.stats.items()]
+            return {"iterations": self.iterations, "stats": stats}
+
+    def restore(self, snapshot):
+        # the nodes must already be in the progress store
+        with self._lock:
+            self.root = self.progress.root
+            self.iterations = snapshot["iterations"]
+            self.stats = {}
+            for index, visits, value_sum, children in snapshot["stats"]:
+                stats = self.stats[index] = NodeStatistics(visits, value_sum)
+                stats.children = None if children is None else [self.progress.store[child] for child in children]
+
+    def best(self, exclude=()):
+        # follow the most visited child from the root, the usual robust choice for the final move,
+        # skipping the nodes in exclude (indices of known dead ends)
+        with self._lock:
+            node = self.root
+            while True:
+                children = [child for child in self.stats[node.index].children or () if child.index not in exclude]
+                if not children:
+                    return node
+                node = max(children, key=lambda child: (self.stats[child.index].visits, self.stats[child.index].mean()))
@@ -0,0 +1,224 @@
+import bisect
+import contextlib
+import contextvars
+import hashlib
+import json
+import threading
+import time
+
+from tree_of_thoughts.nodes import state_text
+
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_scope = contextvars.ContextVar("tree_of_thoughts_search_scope", default={})
+
+
+@contextlib.contextmanager
+def search_scope(**fields):
+    """Tag every model call made inside the block with fields such as depth and node."""
+    token = _scope.set({**_scope.get(), **fields})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def current_scope():
+    return _scope.get()
+
+
+_costs = contextvars.ContextVar("tree_of_thoughts_call_costs", default=())
+
+
+class CallCost:
+    """Latency and tokens of the model calls made inside a measure_calls block."""
+
+    def __init__(self):
+        self.calls = 0
+        self.latency = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, event):
+        # the calls of one block may run on several threads, e.g. batched value prompts
+        with self._lock:
+            self.calls += 1
+            self.latency += event["latency"]
+            self.prompt_tokens += event["prompt_tokens"]
+            self.completion_tokens += event["completion_tokens"]
+
+    def share(self, n):
+        """The cost of one of n states served by these calls."""
+        n = max(1, n)
+        return {"latency": self.latency / n, "prompt_tokens": self.prompt_tokens / n, "completion_tokens": self.completion_tokens / n}
+
+
+@contextlib.contextmanager
+def measure_calls():
+    """Add up the model calls recorded inside the block, on any Metrics, into the CallCost yielded."""
+    cost = CallCost()
+    token = _costs.set(_costs.get() + (cost,))
+    try:
+        yield cost
+    finally:
+        _costs.reset(token)
+
+
+def state_id(state):
+    # short stable identifier of a search state for tagging events
+    return hashlib.sha1(state_text(state).encode("utf-8")).hexdigest()[:12]
+
+
+class EventBus:
+    def __init__(self):
+        self._listeners = ()
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._listeners = self._listeners + (callback,)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._listeners = tuple(listener for listener in self._listeners if listener is not callback)
+
+    def emit(self, event):
+        for listener in self._listeners:
+            listener(event)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class Metrics:
+    """
+    Collects one event per model call (latency, tokens, retries, cache hits, search depth and
+    node) on an event bus and aggregates them into counters and latency histograms.
+
+    Subscribe to `bus` for the raw events; export the aggregates with to_prometheus() or to_json().
+    """
+
+    def __init__(self, latency_buckets=DEFAULT_LATENCY_BUCKETS):
+        self.bus = EventBus()
+        self.latency_buckets = latency_buckets
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self.bus.subscribe(self.aggregate)
+
+    def subscribe(self, callback):
+        return self.bus.subscribe(callback)
+
+    def unsubscribe(self, callback):
+        self.bus.unsubscribe(callback)
+
+    def record_model_call(self, model, operation, latency=0.0, prompt_tokens=0, completion_tokens=0, retries=0, cache_hit=False, cache=None, error=None):
+        event = {
+            "type": "model_call",
+            "timestamp": time.time(),
+            "model": model,
+            "operation": operation,
+            "latency": latency,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "retries": retries,
+            "cache_hit": cache_hit,
+            "cache": cache,
+            "error": error,
+        }
+        event.update(current_scope())
+        for cost in _costs.get():
+            cost.add(event)
+        self.bus.emit(event)
+        return event
+
+    def _inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def aggregate(self, event):
+        if event.get("type") != "model_call":
+            return
+        labels = {"model": event["model"], "operation": event["operation"]}
+        with self._lock:
+            self._inc("tot_model_calls_total", {**labels, "cache": event["cache"] if event["cache_hit"] else "miss"})
+            if event.get("depth") is not None:
+                self._inc("tot_model_calls_by_depth_total", {"depth": str(event["depth"])})
+            if event["error"]:
+                self._inc("tot_model_errors_total", labels)
+            self._inc("tot_model_retries_total", labels, event["retries"])
+            self._inc("tot_prompt_tokens_total", labels, event["prompt_tokens"])
+            self._inc("tot_completion_tokens_total", labels, event["completion_tokens"])
+            if not event["cache_hit"]:
+                key = ("tot_model_call_latency_seconds", tuple(sorted(labels.items())))
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(self.latency_buckets)
+                histogram.observe(event["latency"])
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(self.counters.items())],
+                "histograms": [{"name": name, "labels": dict(labels), **histogram.to_dict()} for (name, labels), histogram in sorted(self.histograms.items())],
+            }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}{format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                for bound, count in histogram.to_dict()["buckets"].items():
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+# shared by models that are not given their own Metrics instance
+default_metrics = Metrics()
@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import Counter
+
+from tree_of_thoughts.metrics import default_metrics
+from tree_of_thoughts.nodes import state_text
+from tree_of_thoughts.treeofthoughts import AbstractLanguageModel
+
+WORDS = (
+    "consider", "split", "the", "problem", "into", "parts", "check", "each", "case", "combine",
+    "results", "try", "a", "different", "approach", "estimate", "bound", "verify", "answer", "simplify",
+    "expand", "compare", "options", "rule", "out", "edge", "cases", "reuse", "previous", "step",
+)
+
+
+class MockModelError(Exception):
+    pass
+
+
+def latency_sampler(latency):
+    """
+    Turn a latency spec into a function of a random.Random returning seconds.
+    Accepts a number, ('fixed', s), ('uniform', lo, hi), ('lognormal', mu, sigma),
+    ('exponential', mean) or a callable taking the rng.
+    """
+    if latency is None:
+        return lambda rng: 0.0
+    if callable(latency):
+        return latency
+    if isinstance(latency, (int, float)):
+        return lambda rng: float(latency)
+    kind, *params = latency
+    if kind == 'fixed':
+        return lambda rng: float(params[0])
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(params[0], params[1])
+    if kind == 'exponential':
+        return lambda rng: rng.expovariate(1.0 / params[0])
+    raise ValueError(f"Unknown latency distribution {kind!r}. Choose 'fixed', 'uniform', 'lognormal' or 'exponential'.")
+
+
+def stable_uniform(*parts):
+    # process-independent pseudo random number in [0, 1), unlike hash() which is salted per run
+    digest = hashlib.sha256(repr(parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+class MockLanguageModel(AbstractLanguageModel):
+    """
+    Offline, seeded stand-in for an API-backed model, for measuring the search engines.
+
+    Every generated thought gets a hidden quality in [0, 1]; the default scorer values a state
+    by the mean quality of the thoughts in it, so better branches really are better and search
+    strategies can be compared. Output depends only on the seed and the inputs, never on thread
+    scheduling, so runs are repeatable. Latency, failure rate, branching (how many thoughts come
+    back, how many are duplicates or paraphrases) and the scorer are all configurable, and
+    `stats()` reports simulated API calls and tokens. Calls are also recorded on `metrics` with
+    their simulated latency, like the OpenAI models do.
+    """
+
+    def __init__(self, seed=0, evaluation_strategy="value", latency=None, error_rate=0.0, branching=None, duplicate_rate=0.0, paraphrase_rate=0.0, scorer=None, score_noise=0.0, value_batch_size=1, thought_length=8, metrics=None):
+        self.seed = seed
+        self.evaluation_strategy = evaluation_strategy
+        self.sample_latency = latency_sampler(latency)
+        self.error_rate = error_rate
+        # None returns exactly k thoughts, an int caps it, a callable(state, k, rng) decides
+        self.branching = branching
+        self.duplicate_rate = duplicate_rate
+        self.paraphrase_rate = paraphrase_rate
+        self.scorer = scorer if scorer is not None else self.quality_scorer
+        self.score_noise = score_noise
+        self.value_batch_size = max(1, value_batch_size)
+        self.thought_length = thought_length
+        self.metrics = metrics if metrics is not None else default_metrics
+        self.generated = set()
+        self.counters = Counter()
+        self._call_index = Counter()
+        self._lock = threading.Lock()
+
+    def call_key(self, key):
+        # counted by digest, so the counter doesn't keep the full text of every state prompted
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+    def rng(self, *key):
+        # one generator per (inputs, n-th identical call), so concurrent callers can't reorder draws
+        digest = self.call_key(key)
+        with self._lock:
+            index = self._call_index[digest]
+            self._call_index[digest] += 1
+        return random.Random(repr((self.seed, index) + key))
+
+    def count(self, **amounts):
+        with self._lock:
+            self.counters.update(amounts)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def reset_counters(self):
+        with self._lock:
+            self.counters.clear()
+            self._call_index.clear()
+
+    def rng_state(self):
+        # what a resumed run needs to draw and score as this one would: how often each call was
+        # made, and which thoughts were generated (the scorer only rates those)
+        with self._lock:
+            calls = [[key, count] for key, count in self._call_index.items()]
+            return {"calls": calls, "generated": sorted(self.generated)}
+
+    def set_rng_state(self, state):
+        with self._lock:
+            for key, count in state["calls"]:
+                self._call_index[key] = count
+            self.generated.update(state["generated"])
+
+    def state_text(self, state):
+        return state_text(state)
+
+    def quality(self, thought):
+        return stable_uniform(self.seed, 'quality', thought)
+
+    def quality_scorer(self, state):
+        if isinstance(state, str):
+            state = (state,)
+        known = [self.quality(part) for part in state if part in self.generated]
+        if not known:
+            return self.quality(self.state_text(state))
+        return sum(known) / len(known)
+
+    def simulate_call(self, rng, prompt_tokens, completion_tokens):
+        if self.error_rate and rng.random() < self.error_rate:
+            self.count(errors=1)
+            raise MockModelError("simulated API failure")
+        self.count(api_calls=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        return max(0.0, self.sample_latency(rng))
+
+    def make_thoughts(self, state, k, rng):
+        if self.branching is None:
+            n = k
+        elif callable(self.branching):
+            n = self.branching(state, k, rng)
+        else:
+            n = min(k, self.branching)
+        depth = 1 if isinstance(state, str) else len(state)
+        thoughts = []
+        for _ in range(n):
+            if thoughts and rng.random() < self.duplicate_rate:
+                thought = rng.choice(thoughts)
+            elif thoughts and rng.random() < self.paraphrase_rate:
+                words = rng.choice(thoughts).split(' ')
+                words[rng.randrange(1, len(words))] = rng.choice(WORDS)
+                thought = ' '.join(words)
+            else:
+                thought = f"Step {depth}: " + ' '.join(rng.choice(WORDS) for _ in range(self.thought_length))
+            with self._lock:
+                self.generated.add(thought)
+            thoughts.append(thought)
+        return thoughts
+
+    def tokens(self, text):
+        return max(1, len(text) // 4)
+
+    def prepare_generation(self, state, k):
+        state_text = self.state_text(state)
+        rng = self.rng('generate', state_text, k)
+        latency = self.simulate_call(rng, self.tokens(state_text) + 30, 0)
+        thoughts = self.make_thoughts(state, k, rng)
+        completion_tokens = sum(self.tokens(t) for t in thoughts)
+        self.count(generate_calls=1, thoughts_generated=len(thoughts), completion_tokens=completion_tokens)
+        self.metrics.record_model_call('mock', 'generate', latency, self.tokens(state_text) + 30, completion_tokens)
+        return latency, thoughts
+
+    def prepare_evaluation(self, states):
+        states = list(states)
+        texts = [self.state_text(state) for state in states]
+        # sorted so the draw doesn't depend on set iteration order, which varies between processes
+        rng = self.rng('evaluate', self.evaluation_strategy, tuple(sorted(texts)))
+        if self.evaluation_strategy == 'value':
+            calls = math.ceil(len(states) / self.value_batch_size) if states else 0
+        elif self.evaluation_strategy == 'vote':
+            calls = 1
+        else:
+            raise ValueError("Invalid evaluation strategy. Choose 'value' or 'vote'.")
+        prompt_tokens = sum(self.tokens(text) for text in texts) // max(1, calls) + 30
+        latency = sum(self.simulate_call(rng, prompt_tokens, 5) for _ in range(calls))
+        values = {}
+        for state, text in zip(states, texts):
+            value = self.scorer(state)
+            if self.score_noise:
+                value += random.Random(repr((self.seed, 'noise', text))).gauss(0, self.score_noise)
+            values[state] = min(1.0, max(0.0, value))
+        if self.evaluation_strategy == 'vote' and values:
+            best = max(states, key=lambda state: values[state])
+            values = {state: 1 if state == best else 0 for state in states}
+        self.count(evaluate_calls=1, states_evaluated=len(states))
+        self.metrics.record_model_call('mock', self.evaluation_strategy, latency, prompt_tokens * calls, 5 * calls)
+        return latency, values
+
+    def generate_thoughts(self, state, k):
+        latency, thoughts = self.prepare_generation(state, k)
+        time.sleep(latency)
+        return thoughts
+
+    def evaluate_states(self, states):
+        latency, values = self.prepare_evaluation(states)
+        time.sleep(latency)
+        return values
+
+    async def agenerate_thoughts(self, state, k):
+        latency, thoughts = self.prepare_generation(state, k)
+        await asyncio.sleep(latency)
+        return thoughts
+
+    async def aevaluate_states(self, states):
+        latency, values = self.prepare_evaluation(states)
+        await asyncio.sleep(latency)
+        return values
+
+
+def keyword_scorer(keywords, weight=1.0):
+    """Scorer rewarding states whose text mentions the given keywords, for plugging into MockLanguageModel."""
+    keywords = [keyword.lower() for keyword in keywords]
+
+    def score(state):
+        text = state_text(state).lower()
+        hits = sum(1 for keyword in keywords if keyword in text)
+        return min(1.0, weight * hits / max(1, len(keywords)))
+
+    return score
@@ -0,0 +1,120 @@
+import collections
+import sys
+import threading
+
+
+def state_text(state):
+    """Prompt text of a search state: a ThoughtNode, a plain problem string or a sequence of thoughts."""
+    if isinstance(state, str):
+        return state
+    if isinstance(state, ThoughtNode):
+        return state.text
+    return ' '.join(state)
+
+
+class ThoughtNode:
+    """
+    One state of the search tree. A node only holds its own thought and the index of its parent
+    in the NodeStore, so expanding a state no longer copies the whole ancestor path. Iterating a
+    node yields the thoughts from the root down, which keeps it usable wherever a tuple state was.
+    """
+
+    __slots__ = ("store", "index", "parent", "depth", "thought")
+
+    def __init__(self, store, index, parent, depth, thought):
+        self.store = store
+        self.index = index
+        self.parent = parent
+        self.depth = depth
+        self.thought = thought
+
+    @property
+    def parent_node(self):
+        return None if self.parent is None else self.store.nodes[self.parent]
+
+    @property
+    def text(self):
+        return self.store.text(self)
+
+    def path(self):
+        nodes = []
+        node = self
+        while node is not None:
+            nodes.append(node)
+            node = node.parent_node
+        return nodes[::-1]
+
+    def __iter__(self):
+        return (node.thought for node in self.path())
+
+    def __len__(self):
+        return self.depth + 1
+
+    def __repr__(self):
+        return f"ThoughtNode({self.index}, depth={self.depth}, thought={self.thought!r})"
+
+
+class NodeStore:
+    """
+    Array of every ThoughtNode of a search. Thought strings are interned and a (parent, thought)
+    pair always maps to the same node, so repeated expansions don't grow the tree.
+
+    Full state texts are only kept for the text_cache_size nodes used last (the frontier the
+    search is working on), so the memory they take doesn't grow with depth times tree size.
+    An evicted text is rebuilt with one join over the path when it's needed again.
+    """
+
+    def __init__(self, text_cache_size=64):
+        self.nodes = []
+        self.children = {}
+        self.text_cache_size = text_cache_size
+        self.texts = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def root(self, problem):
+        return self.add(None, problem)
+
+    def add(self, parent, thought):
+        parent_index = None if parent is None else parent.index
+        thought = sys.intern(str(thought))
+        key = (parent_index, thought)
+        with self._lock:
+            index = self.children.get(key)
+            if index is not None:
+                return self.nodes[index]
+            depth = 0 if parent is None else parent.depth + 1
+            node = ThoughtNode(self, len(self.nodes), parent_index, depth, thought)
+            self.nodes.append(node)
+            self.children[key] = node.index
+            return node
+
+    def text(self, node):
+        with self._lock:
+            text = self.texts.get(node.index)
+            if text is not None:
+                self.texts.move_to_end(node.index)
+                return text
+            # from the nearest cached ancestor down, in a single join
+            parts = []
+            ancestor = node
+            while ancestor is not None:
+                cached = self.texts.get(ancestor.index)
+                if cached is not None:
+                    parts.append(cached)
+                    break
+                parts.append(ancestor.thought)
+                ancestor = ancestor.parent_node
+            text = ' '.join(reversed(parts))
+            self.texts[node.index] = text
+            if len(self.texts) > self.text_cache_size:
+                self.texts.popitem(last=False)
+            return text
+
+    def expand(self, parent, thoughts):
+        return [self.add(parent, thought) for thought in thoughts]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __getitem__(self, index):
+        return self.nodes[index]
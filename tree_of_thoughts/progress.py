@@ -0,0 +1,133 @@
+import itertools
+import threading
+
+from tree_of_thoughts.nodes import NodeStore
+
+
+class SearchProgress:
+    """
+    What the searches learned about one problem, kept by solve across its retries: the node
+    store, the kept children and the value of every node expanded or scored so far, the final
+    answers generated, and the nodes that turned out to be dead ends (an empty final answer, or
+    nothing left below them).
+
+    A search given a SearchProgress replays the known part of the tree without model calls and
+    spends the new attempt on what it hasn't tried: BFS and best-first move on to the next-best
+    states, DFS also visits the children it pruned as unpromising, MCTS keeps its statistics
+    and runs more iterations. retry() ends the loop once an attempt found nothing new to pay for.
+    """
+
+    def __init__(self, x):
+        self.store = NodeStore()
+        self.root = self.store.root(x)
+        self.children = {}
+        self.values = {}
+        self.answers = {}
+        self.exhausted = set()
+        self.attempts = 0
+        # model calls made on behalf of this problem
+        self.work = 0
+        self._work_at_start = 0
+        # best-first frontier and MCTS statistics, picked up by the next attempt
+        self.frontier = None
+        self.order = itertools.count()
+        self.mcts = None
+        self.mcts_state = None
+        # set by Checkpointer.start, told about every change
+        self.checkpointer = None
+        # MCTS workers record their expansions from several threads
+        self.lock = threading.RLock()
+
+    def retry(self):
+        """Start an attempt, unless the last one made no model call and would only be replayed."""
+        with self.lock:
+            if self.attempts and self.work == self._work_at_start:
+                return False
+            self.attempts += 1
+            self._work_at_start = self.work
+            self.changed()
+            return True
+
+    def changed(self):
+        if self.checkpointer is not None:
+            self.checkpointer.changed(self)
+
+    def close(self):
+        if self.checkpointer is not None:
+            with self.lock:
+                self.checkpointer.close(self)
+
+    def expanded(self, node):
+        return self.children.get(node.index)
+
+    def add_expansions(self, expansions, merge):
+        """
+        Add the thoughts generated for states not expanded before, as (state, thoughts) pairs.
+        The children of all of them go through merge together, as one search level would, and
+        what merge keeps is recorded per parent and returned.
+        """
+        if not expansions:
+            return {}
+        children = {s: self.store.expand(s, thoughts) for s, thoughts in expansions}
+        kept = set(merge(child for group in children.values() for child in group))
+        with self.lock:
+            for s, group in children.items():
+                self.children[s.index] = [child for child in group if child in kept]
+                self.work += 1
+            self.changed()
+            return {s: self.children[s.index] for s in children}
+
+    def missing_values(self, states):
+        return [s for s in states if s.index not in self.values]
+
+    def add_values(self, values):
+        with self.lock:
+            if values:
+                self.work += 1
+            for s, value in values.items():
+                self.values[s.index] = value
+            self.changed()
+
+    def scores(self, states, evaluate):
+        missing = self.missing_values(states)
+        if missing:
+            self.add_values(evaluate(missing))
+        return {s: self.values[s.index] for s in states}
+
+    async def ascores(self, states, evaluate):
+        missing = self.missing_values(states)
+        if missing:
+            self.add_values(await evaluate(missing))
+        return {s: self.values[s.index] for s in states}
+
+    def unfinished(self, index):
+        # not a dead end, and not expanded or with children left unscored
+        if index in self.exhausted:
+            return False
+        children = self.children.get(index)
+        return children is None or any(child.index not in self.values for child in children)
+
+    def is_exhausted(self, node):
+        return node.index in self.exhausted
+
+    def exhaust(self, node):
+        # a parent whose children are all dead ends has nothing left to try either
+        with self.lock:
+            while node is not None:
+                self.exhausted.add(node.index)
+                node = node.parent_node
+                children = None if node is None else self.children.get(node.index)
+                if not children or not all(child.index in self.exhausted for child in children):
+                    break
+
+    def answer(self, node):
+        return self.answers.get(node.index)
+
+    def answered(self, node, thoughts):
+        with self.lock:
+            self.work += 1
+            self.answers[node.index] = thoughts
+            if not thoughts:
+                self.exhaust(node)
+            self.changed()
+            return thoughts
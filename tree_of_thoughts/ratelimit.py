@@ -0,0 +1,232 @@
+import asyncio
+import collections
+import contextlib
+import os
+import re
+import threading
+import time
+
+from tree_of_thoughts.scheduler import AsyncWaiter
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute. reserve() always succeeds and returns
+    how long the caller has to wait before its reservation is covered, which lets the same bucket
+    serve blocking threads and asyncio tasks.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount=1):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+            return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def adjust(self, amount):
+        # positive amounts hand back an over-estimate, negative ones charge an under-estimate
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    Client-side limiter shared by every model instance that talks to the same API model.
+
+    Requests and tokens per minute are enforced with token buckets. The number of requests in
+    flight follows AIMD: it grows by one every `limit` successful calls and is cut by
+    `decrease` on every 429, while a shared cooldown (Retry-After when the server sends one)
+    pauses all callers instead of each worker sleeping on its own.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_concurrency=32, min_concurrency=1, initial_concurrency=None, decrease=0.5, max_cooldown=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(initial_concurrency or max_concurrency)
+        self.decrease = decrease
+        if max_cooldown is None:
+            max_cooldown = float(os.environ.get("OPENAI_RATE_TIMEOUT", 30))
+        self.max_cooldown = max_cooldown
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.consecutive_rate_limits = 0
+        self.rate_limited_count = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+        # tasks of any event loop waiting for a slot, woken like the threads waiting on _cond
+        self._async_waiters = collections.deque()
+
+    def _enter_locked(self):
+        # caller holds _cond; returns 0.0 once entered, else the cooldown left or None when full
+        wait = self.cooldown_until - time.monotonic()
+        if wait > 0:
+            return wait
+        if self.in_flight >= int(self.limit):
+            return None
+        self.in_flight += 1
+        return 0.0
+
+    def _reserve(self, tokens):
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def _wake_locked(self):
+        # caller holds _cond; wakes a waiting thread and the longest waiting task to check again
+        self._cond.notify()
+        while self._async_waiters:
+            try:
+                self._async_waiters.popleft().grant()
+                return
+            except RuntimeError:
+                # its event loop is closed
+                continue
+
+    def _leave(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._wake_locked()
+
+    @contextlib.contextmanager
+    def acquire(self, tokens=0):
+        # check and wait under one lock hold, so a _leave() in between can't notify nobody
+        with self._cond:
+            while True:
+                wait = self._enter_locked()
+                if wait == 0.0:
+                    break
+                self._cond.wait(wait)
+        try:
+            wait = self._reserve(tokens)
+            if wait > 0:
+                time.sleep(wait)
+            yield self
+        finally:
+            self._leave()
+
+    @contextlib.asynccontextmanager
+    async def aacquire(self, tokens=0):
+        while True:
+            with self._cond:
+                wait = self._enter_locked()
+                if wait == 0.0:
+                    break
+                if wait is None:
+                    waiter = AsyncWaiter(asyncio.get_running_loop())
+                    self._async_waiters.append(waiter)
+            if wait is not None:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                with self._cond:
+                    if waiter.granted:
+                        # the wakeup it was handed goes to the next waiter
+                        self._wake_locked()
+                    else:
+                        self._async_waiters.remove(waiter)
+                raise
+        try:
+            wait = self._reserve(tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield self
+        finally:
+            self._leave()
+
+    def on_success(self, estimated_tokens=0, actual_tokens=None):
+        if self.tokens is not None and actual_tokens is not None:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+        with self._cond:
+            self.consecutive_rate_limits = 0
+            self._successes += 1
+            if self._successes >= self.limit:
+                self._successes = 0
+                self.limit = min(self.max_concurrency, self.limit + 1)
+                self._wake_locked()
+
+    def on_rate_limited(self, retry_after=None):
+        with self._cond:
+            self.rate_limited_count += 1
+            self.consecutive_rate_limits += 1
+            self._successes = 0
+            self.limit = max(self.min_concurrency, self.limit * self.decrease)
+            if retry_after is None:
+                retry_after = min(self.max_cooldown, 2 ** (self.consecutive_rate_limits - 1))
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + retry_after)
+            return retry_after
+
+    def stats(self):
+        with self._cond:
+            return {"concurrency_limit": int(self.limit), "in_flight": self.in_flight, "rate_limited": self.rate_limited_count}
+
+
+_rate_limiters = {}
+_rate_limit_config = {}
+_registry_lock = threading.Lock()
+
+
+def configure_rate_limit(model, **limits):
+    """Set the limits used for model; limiters created afterwards for that model pick them up."""
+    with _registry_lock:
+        _rate_limit_config[model] = limits
+        _rate_limiters.pop(model, None)
+
+
+def get_rate_limiter(model):
+    with _registry_lock:
+        limiter = _rate_limiters.get(model)
+        if limiter is None:
+            limiter = _rate_limiters[model] = RateLimiter(**_rate_limit_config.get(model, {}))
+        return limiter
+
+
+def _parse_duration(value):
+    # handles plain seconds as well as the '1m30s' / '250ms' form of x-ratelimit-reset-* headers
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r'([\d.]+)(ms|h|m|s)', value):
+        matched = True
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total if matched else None
+
+
+def retry_after_seconds(error):
+    headers = getattr(error, "headers", None) or {}
+    headers = {str(key).lower(): value for key, value in dict(headers).items()}
+    if "retry-after-ms" in headers:
+        return float(headers["retry-after-ms"]) / 1000
+    for header in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        if header in headers:
+            seconds = _parse_duration(headers[header])
+            if seconds is not None:
+                return seconds
+    return None
+
+
+def estimate_tokens(prompt, max_tokens, n=1):
+    # about four characters per token for English text, plus every completion the request may produce
+    return len(prompt) // 4 + max_tokens * n
@@ -0,0 +1,49 @@
+import logging
+
+
+class NullReporter:
+    """Drops every report. The default, so headless searches pay nothing for progress output."""
+
+    def report(self, message, *args):
+        pass
+
+
+class LoggingReporter:
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger("tree_of_thoughts")
+        self.level = level
+
+    def report(self, message, *args):
+        # formatting is left to logging, so it only happens for records that are emitted
+        self.logger.log(self.level, message, *args)
+
+
+class StreamlitReporter:
+    """Shows reports in the running Streamlit app. streamlit is only imported on the first report."""
+
+    def __init__(self, method="code"):
+        self.method = method
+        self._write = None
+
+    def report(self, message, *args):
+        if self._write is None:
+            import streamlit
+            self._write = getattr(streamlit, self.method)
+        self._write(message % args if args else message)
+
+
+_reporter = NullReporter()
+
+
+def set_reporter(reporter):
+    """Send the progress reports of every model and search to reporter; None drops them."""
+    global _reporter
+    _reporter = NullReporter() if reporter is None else reporter
+
+
+def get_reporter():
+    return _reporter
+
+
+def report(message, *args):
+    _reporter.report(message, *args)
@@ -0,0 +1,96 @@
+import contextlib
+import contextvars
+import random
+import time
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+_deadline = contextvars.ContextVar("tree_of_thoughts_deadline", default=None)
+
+
+@contextlib.contextmanager
+def deadline_scope(timeout):
+    """Bound every API call made inside the block to finish within timeout seconds (None for no limit)."""
+    if timeout is None:
+        yield None
+        return
+    deadline = time.monotonic() + timeout
+    outer = _deadline.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time():
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class RetryPolicy:
+    """
+    Decides whether a failed API call is retried and how long to wait first.
+
+    Delays grow exponentially from base_delay up to max_delay with full jitter, a server
+    provided Retry-After is used as a floor, and every request gets request_timeout seconds.
+    Both are clipped to the deadline of the surrounding solve: once the remaining budget can't
+    cover the next wait, DeadlineExceeded is raised instead of starting another attempt.
+    """
+
+    def __init__(self, max_attempts=10, base_delay=1.0, max_delay=30.0, jitter=True, request_timeout=60, retry_on=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.request_timeout = request_timeout
+        if retry_on is None:
+            import openai
+
+            retry_on = (
+                openai.error.RateLimitError,
+                openai.error.Timeout,
+                openai.error.APIConnectionError,
+                openai.error.ServiceUnavailableError,
+                openai.error.TryAgain,
+                openai.error.APIError,
+            )
+        self.retry_on = tuple(retry_on)
+
+    def check_deadline(self, wait=0):
+        remaining = remaining_time()
+        if remaining is not None and remaining <= wait:
+            if wait:
+                raise DeadlineExceeded(f"waiting {wait:.1f}s to retry would overrun the solve deadline")
+            raise DeadlineExceeded("solve deadline reached before the request could start")
+
+    def call_timeout(self):
+        remaining = remaining_time()
+        if remaining is None:
+            return self.request_timeout
+        if self.request_timeout is None:
+            return remaining
+        return min(self.request_timeout, remaining)
+
+    def should_retry(self, error, attempt):
+        if self.max_attempts is not None and attempt + 1 >= self.max_attempts:
+            return False
+        return isinstance(error, self.retry_on)
+
+    def delay(self, attempt, retry_after=None):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        remaining = remaining_time()
+        if remaining is not None and delay >= remaining:
+            raise DeadlineExceeded(f"retrying in {delay:.1f}s would overrun the solve deadline")
+        return delay
@@ -0,0 +1,322 @@
+"""
+Solve a JSONL file of problems with a pool of worker processes, on one host or several.
+
+    python -m tree_of_thoughts.runner add queue.db problems.jsonl
+    python -m tree_of_thoughts.runner work queue.db --processes 8 --algorithm BFS --k 5 --T 3 --b 5 --vth 0.5
+    python -m tree_of_thoughts.runner status queue.db
+    python -m tree_of_thoughts.runner export queue.db results.jsonl
+
+The problems go into a SQLite work queue. Every worker leases problems from it, solves them with
+solve_many and writes each result back as soon as it is done. A lease that isn't renewed (the
+worker died, the host went away) expires and the problem is handed to another worker, up to
+--max-attempts times. Results are written once: a late duplicate of a problem already done is
+dropped. To spread the work over several hosts run `work` on each of them against the same
+queue file on a shared filesystem whose locks work across hosts, or against a copy per host
+after splitting the problems with `add --shard i/n`. The queue keeps SQLite's rollback journal
+(DELETE), which only needs file locks; `work --journal-mode WAL` is faster but needs shared
+memory, so only use it when every worker runs on the host that has the file.
+
+Each line of the problem file is a JSON object with a "problem" (and optionally an "id") or
+a bare JSON string. Without an id the problem is identified by its hash, so adding the same
+file twice doesn't queue anything twice.
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+from tree_of_thoughts.traces import TraceWriter
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS problems (
+    id TEXT PRIMARY KEY,
+    problem TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS problems_status ON problems (status, lease_expires);
+"""
+
+
+def problem_id(problem):
+    return hashlib.sha1(problem.encode("utf-8")).hexdigest()
+
+
+def read_problems(path):
+    """Yield (id, problem) pairs from a JSONL file."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"problem": record}
+            problem = record["problem"]
+            yield str(record.get("id") or problem_id(problem)), problem
+
+
+class WorkQueue:
+    """
+    Problems and their results in a SQLite file, shared by any number of worker processes.
+
+    A problem is pending, leased to one owner until its lease expires, done or failed. lease()
+    hands out pending problems and the ones whose lease ran out, renew() keeps the leases of a
+    live worker, complete() stores a result once and fail() puts the problem back for another
+    attempt, or marks it failed after max_attempts. journal_mode switches the file to that
+    SQLite journal mode, None leaves it as it is.
+    """
+
+    def __init__(self, path, lease_seconds=300, max_attempts=3, journal_mode=None):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # autocommit, transactions are opened explicitly with BEGIN IMMEDIATE
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        if journal_mode is not None:
+            self.connection.execute(f"PRAGMA journal_mode={journal_mode}")
+        self.connection.executescript(SCHEMA)
+        # the solving threads and the heartbeat of a worker share the connection
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, problems):
+        """Queue (id, problem) pairs, skipping ids already in the queue. Returns how many were added."""
+        now = time.time()
+        with self.transaction() as db:
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO problems (id, problem, updated) VALUES (?, ?, ?)", ((id, problem, now) for id, problem in problems))
+            return db.total_changes - before
+
+    def lease(self, owner, n=1):
+        """Lease up to n problems to owner, returning (id, problem) pairs."""
+        now = time.time()
+        with self.transaction() as db:
+            # leases of dead workers that already had all their attempts
+            db.execute("UPDATE problems SET status = 'failed', error = coalesce(error, 'lease expired'), lease_owner = NULL, lease_expires = NULL, updated = ? WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?", (now, now, self.max_attempts))
+            rows = db.execute("SELECT id, problem FROM problems WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) AND attempts < ? ORDER BY attempts, rowid LIMIT ?", (now, self.max_attempts, n)).fetchall()
+            db.executemany("UPDATE problems SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated = ? WHERE id = ?", ((owner, now + self.lease_seconds, now, id) for id, _ in rows))
+        return rows
+
+    def renew(self, owner, ids):
+        """Extend the leases owner still holds on ids."""
+        if not ids:
+            return
+        now = time.time()
+        with self.transaction() as db:
+            db.executemany("UPDATE problems SET lease_expires = ?, updated = ? WHERE id = ? AND status = 'leased' AND lease_owner = ?", ((now + self.lease_seconds, now, id, owner) for id in ids))
+
+    def complete(self, id, result):
+        """Store the result of a problem unless it is done already. Returns False for a duplicate."""
+        now = time.time()
+        with self.transaction() as db:
+            # a worker whose lease expired may still finish; its result is as good as any, the first one wins
+            cursor = db.execute("UPDATE problems SET status = 'done', result = ?, error = NULL, lease_owner = NULL, lease_expires = NULL, updated = ? WHERE id = ? AND status != 'done'", (result, now, id))
+            return cursor.rowcount > 0
+
+    def fail(self, id, owner, error):
+        """Give up owner's lease on a problem after an error, queueing it again while it has attempts left."""
+        now = time.time()
+        with self.transaction() as db:
+            db.execute("UPDATE problems SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error = ?, lease_owner = NULL, lease_expires = NULL, updated = ? WHERE id = ? AND status = 'leased' AND lease_owner = ?", (self.max_attempts, error, now, id, owner))
+
+    def busy(self, owner):
+        """Whether some other worker holds a lease that may still come back to the queue."""
+        with self._lock:
+            row = self.connection.execute("SELECT count(*) FROM problems WHERE status = 'leased' AND (lease_owner != ? OR lease_expires < ?) AND attempts < ?", (owner, time.time(), self.max_attempts)).fetchone()
+        return row[0] > 0
+
+    def counts(self):
+        with self._lock:
+            return dict(self.connection.execute("SELECT status, count(*) FROM problems GROUP BY status").fetchall())
+
+    def results(self):
+        """Yield a record per problem that is done or failed."""
+        with self._lock:
+            rows = self.connection.execute("SELECT id, problem, status, attempts, result, error FROM problems WHERE status IN ('done', 'failed') ORDER BY rowid").fetchall()
+        for id, problem, status, attempts, result, error in rows:
+            yield {"id": id, "problem": problem, "status": status, "attempts": attempts, "result": None if result is None else json.loads(result), "error": error}
+
+
+def build_tree(config):
+    from tree_of_thoughts.mock import MockLanguageModel
+    from tree_of_thoughts.treeofthoughts import OpenAILanguageModel, OptimizedTreeofThoughts, TreeofThoughts
+
+    if config["model"] == "mock":
+        model = MockLanguageModel(seed=config["seed"], latency=config["latency"], evaluation_strategy=config["evaluation_strategy"])
+    else:
+        model = OpenAILanguageModel(api_key="", strategy=config["strategy"], evaluation_strategy=config["evaluation_strategy"], api_model=config["api_model"])
+    engine = OptimizedTreeofThoughts if config["engine"] == "optimized" else TreeofThoughts
+    return engine(model, config["algorithm"], max_concurrency=config["max_concurrency"])
+
+
+def work(path, config, owner=None):
+    """
+    Lease and solve problems from the queue at path until none are left, including the ones
+    leased to other workers that may still come back. Returns how many results were written.
+    """
+    owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+    queue = WorkQueue(path, config["lease_seconds"], config["max_attempts"], config["journal_mode"])
+    tree = build_tree(config)
+    if config["checkpoint_dir"]:
+        os.makedirs(config["checkpoint_dir"], exist_ok=True)
+    trace = None
+    if config["trace_dir"]:
+        os.makedirs(config["trace_dir"], exist_ok=True)
+        # one file per worker, so no two processes append to the same gzip stream
+        trace = TraceWriter(os.path.join(config["trace_dir"], owner.replace(":", "-") + ".jsonl.gz"), max_bytes=config["trace_max_bytes"])
+    leased = set()
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(queue.lease_seconds / 3):
+            queue.renew(owner, list(leased))
+
+    def problems(ids):
+        # leased one at a time, as solve_many has room, so a slow worker doesn't sit on a backlog
+        while True:
+            rows = queue.lease(owner, 1)
+            if not rows:
+                return
+            id, problem = rows[0]
+            ids.append(id)
+            leased.add(id)
+            yield problem
+
+    written = 0
+    thread = threading.Thread(target=heartbeat, name="tree-of-thoughts-runner-heartbeat", daemon=True)
+    thread.start()
+    try:
+        while True:
+            # solve_many numbers the problems of each round from 0
+            ids = []
+            options = {"trace": trace}
+            if config["checkpoint_dir"]:
+                # a problem leased again after its worker died continues from where that one stopped
+                options["checkpoint"] = lambda index, x, ids=ids: os.path.join(config["checkpoint_dir"], f"{problem_id(ids[index])}.jsonl")
+            for index, result in tree.solve_many(problems(ids), config["k"], config["T"], config["b"], config["vth"], config["timeout"], max_problems=config["max_problems"], return_exceptions=True, **options):
+                id = ids[index]
+                if isinstance(result, Exception):
+                    print(f"{owner}: problem {id} failed: {type(result).__name__}: {result}", file=sys.stderr)
+                    queue.fail(id, owner, f"{type(result).__name__}: {result}")
+                elif queue.complete(id, json.dumps(result, default=str)):
+                    written += 1
+                leased.discard(id)
+            if not queue.busy(owner):
+                break
+            time.sleep(config["poll_interval"])
+    finally:
+        stop.set()
+        queue.close()
+        if trace is not None:
+            trace.close()
+    return written
+
+
+def run_workers(path, config, processes):
+    """Run work() in processes worker processes and return the number of results they wrote."""
+    if processes <= 1:
+        return work(path, config)
+    # spawn, so the workers don't inherit the parent's threads and open connections
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes) as pool:
+        return sum(pool.starmap(work, [(path, config)] * processes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve a JSONL file of problems with worker processes sharing a SQLite work queue.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="queue the problems of a JSONL file")
+    add.add_argument("queue")
+    add.add_argument("problems")
+    add.add_argument("--shard", default=None, help="i/n, queue only the i-th of n shards of the file (by problem id)")
+
+    run = commands.add_parser("work", help="solve queued problems until none are left")
+    run.add_argument("queue")
+    run.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    run.add_argument("--engine", default="default", choices=["default", "optimized"])
+    run.add_argument("--algorithm", default="BFS", choices=["BFS", "DFS", "BestFirst", "MCTS"])
+    run.add_argument("--model", default="openai", choices=["openai", "mock"], help="mock runs offline on MockLanguageModel")
+    run.add_argument("--api-model", default="", help="defaults to OPENAI_API_MODEL")
+    run.add_argument("--strategy", default="cot", choices=["cot", "propose"])
+    run.add_argument("--evaluation-strategy", default="value", choices=["value", "vote"])
+    run.add_argument("--seed", type=int, default=0, help="seed of the mock model")
+    run.add_argument("--latency", type=float, default=0.0, help="simulated seconds per mock model call")
+    run.add_argument("--k", type=int, default=5)
+    run.add_argument("--T", type=int, default=3)
+    run.add_argument("--b", type=int, default=5)
+    run.add_argument("--vth", type=float, default=0.5)
+    run.add_argument("--timeout", type=float, default=None, help="seconds per problem")
+    run.add_argument("--max-concurrency", type=int, default=16, help="model calls in flight per process")
+    run.add_argument("--max-problems", type=int, default=None, help="problems solved at once per process")
+    run.add_argument("--lease-seconds", type=float, default=300.0, help="how long a problem stays with a worker that stopped renewing")
+    run.add_argument("--max-attempts", type=int, default=3)
+    run.add_argument("--journal-mode", default="DELETE", choices=["DELETE", "WAL"], help="WAL only works with every worker on the host that has the queue file")
+    run.add_argument("--poll-interval", type=float, default=5.0, help="seconds between looks for expired leases once the queue is drained")
+    run.add_argument("--checkpoint-dir", default=None, help="checkpoint every problem here, so a retried one resumes")
+    run.add_argument("--trace-dir", default=None, help="export the search trees here as gzipped JSONL, a file per worker")
+    run.add_argument("--trace-max-bytes", type=int, default=None, help="rotate the trace files after this many bytes of JSON")
+
+    status = commands.add_parser("status", help="count the problems by status")
+    status.add_argument("queue")
+
+    export = commands.add_parser("export", help="write the finished problems to a JSONL file")
+    export.add_argument("queue")
+    export.add_argument("out")
+    args = parser.parse_args(argv)
+
+    if args.command == "work":
+        config = {key: getattr(args, key) for key in ("engine", "algorithm", "model", "api_model", "strategy", "evaluation_strategy", "seed", "latency", "k", "T", "b", "vth", "timeout", "max_concurrency", "max_problems", "lease_seconds", "max_attempts", "journal_mode", "poll_interval", "checkpoint_dir", "trace_dir", "trace_max_bytes")}
+        # create the file and set its journal mode before the workers race to
+        WorkQueue(args.queue, journal_mode=args.journal_mode).close()
+        print(f"Wrote {run_workers(args.queue, config, args.processes)} results")
+
+    queue = WorkQueue(args.queue)
+    try:
+        if args.command == "add":
+            problems = read_problems(args.problems)
+            if args.shard:
+                shard, shards = (int(part) for part in args.shard.split("/"))
+                problems = ((id, problem) for id, problem in problems if int(problem_id(id), 16) % shards == shard)
+            print(f"Queued {queue.add(problems)} problems")
+        elif args.command == "export":
+            count = 0
+            with open(args.out, "w", encoding="utf-8") as out:
+                for record in queue.results():
+                    out.write(json.dumps(record) + "\n")
+                    count += 1
+            print(f"Exported {count} problems to {args.out}")
+        counts = queue.counts()
+        print(", ".join(f"{status}={counts.get(status, 0)}" for status in ("pending", "leased", "done", "failed")))
+    finally:
+        queue.close()
+    return 1 if args.command == "work" and counts.get("failed") else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
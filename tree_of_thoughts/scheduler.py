@@ -0,0 +1,148 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import threading
+
+_current = contextvars.ContextVar("tree_of_thoughts_scheduler", default=None)
+_workers = contextvars.ContextVar("tree_of_thoughts_search_workers", default=None)
+
+
+class ThreadWaiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+    def grant(self):
+        self.granted = True
+        self.event.set()
+
+
+class AsyncWaiter:
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+    def grant(self):
+        self.granted = True
+        # release() may run on another thread or another task
+        self.loop.call_soon_threadsafe(self.wake)
+
+    def wake(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class FairScheduler:
+    """
+    At most max_concurrency model calls in flight across all the problems being solved. When
+    all slots are taken, callers queue per problem and a freed slot goes to the next problem in
+    round-robin order, so a problem with many calls waiting (a wide BFS level, MCTS workers)
+    can't starve the others. Works for threads and asyncio tasks alike.
+    """
+
+    def __init__(self, max_concurrency=16):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.waiting = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key, waiter):
+        # take a free slot, or queue the waiter; returns True when the slot was taken
+        with self._lock:
+            if self.active < self.max_concurrency and not self.waiting:
+                self.active += 1
+                return True
+            self.waiting.setdefault(key, collections.deque()).append(waiter)
+            return False
+
+    def acquire(self, key):
+        waiter = ThreadWaiter()
+        if not self.try_acquire(key, waiter):
+            waiter.event.wait()
+
+    async def aacquire(self, key):
+        waiter = AsyncWaiter(asyncio.get_running_loop())
+        if self.try_acquire(key, waiter):
+            return
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self.remove(key, waiter)
+            if granted:
+                self.release()
+            raise
+
+    def remove(self, key, waiter):
+        queue = self.waiting.get(key)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self.waiting[key]
+
+    def release(self):
+        with self._lock:
+            if not self.waiting:
+                self.active -= 1
+                return
+            key, queue = next(iter(self.waiting.items()))
+            waiter = queue.popleft()
+            if queue:
+                self.waiting.move_to_end(key)
+            else:
+                del self.waiting[key]
+            # the slot passes straight to the waiter, active stays the same
+            waiter.grant()
+
+
+@contextlib.contextmanager
+def scheduled(scheduler, key, max_workers=None):
+    """
+    Route the model calls of the searches inside the block through scheduler, queued under key.
+    max_workers caps the threads each of those searches starts for its own model calls.
+    """
+    token = _current.set((scheduler, key))
+    workers_token = _workers.set(max_workers)
+    try:
+        yield
+    finally:
+        _workers.reset(workers_token)
+        _current.reset(token)
+
+
+def search_workers(n):
+    """How many threads a search may start for n model calls: n, or less inside scheduled(..., max_workers)."""
+    limit = _workers.get()
+    return n if limit is None else max(1, min(n, limit))
+
+
+@contextlib.contextmanager
+def call_slot():
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    scheduler, key = current
+    scheduler.acquire(key)
+    try:
+        yield
+    finally:
+        scheduler.release()
+
+
+@contextlib.asynccontextmanager
+async def acall_slot():
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    scheduler, key = current
+    await scheduler.aacquire(key)
+    try:
+        yield
+    finally:
+        scheduler.release()
@@ -0,0 +1,160 @@
+import collections
+import contextlib
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from tree_of_thoughts.events import extra_listener
+
+# expansions whose children haven't all been seen yet, per search; older ones are forgotten
+MAX_OPEN_EXPANSIONS = 4096
+
+
+def problem_key(x):
+    return hashlib.sha1(str(x).encode("utf-8")).hexdigest()
+
+
+class TraceWriter:
+    """
+    Append-only JSONL export of the trees searched by solve(..., trace=writer), one record per
+    node written as soon as the node is scored: problem, node, parent, depth, thought, score,
+    and the latency and tokens of the model calls spent on it (its share of the call that
+    generated it and of the evaluation that scored it). The root record carries the problem
+    text, and "answer" records the final answers generated below a node.
+
+    Nothing is kept beyond the nodes waiting for a score, so batch runs of any size export in
+    constant memory. Paths ending in .gz are gzip compressed. With max_bytes the output rotates
+    to path-00000.jsonl, path-00001.jsonl, ... after that many bytes of JSON, never overwriting
+    an existing part. One writer can be shared by the problems of solve_many.
+    """
+
+    def __init__(self, path, compress=None, max_bytes=None):
+        self.path = str(path)
+        self.compress = self.path.endswith(".gz") if compress is None else compress
+        self.max_bytes = max_bytes
+        self.file = None
+        self.part = None
+        self.written = 0
+        self.records = 0
+        self._lock = threading.Lock()
+
+    def part_path(self, part):
+        if self.max_bytes is None:
+            return self.path
+        directory, name = os.path.split(self.path)
+        stem, dot, suffix = name.partition(".")
+        return os.path.join(directory, f"{stem}-{part:05d}{dot}{suffix}")
+
+    def open(self):
+        if self.part is None:
+            self.part = 0
+            while self.max_bytes is not None and os.path.exists(self.part_path(self.part)):
+                self.part += 1
+        path = self.part_path(self.part)
+        self.file = gzip.open(path, "at", encoding="utf-8") if self.compress else open(path, "a", encoding="utf-8")
+        self.written = 0
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self.file is None:
+                self.open()
+            self.file.write(line)
+            self.records += 1
+            self.written += len(line.encode("utf-8"))
+            if self.max_bytes is not None and self.written >= self.max_bytes:
+                self.file.close()
+                self.file = None
+                self.part += 1
+
+    def flush(self):
+        with self._lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self._lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextlib.contextmanager
+    def recording(self, x, problem=None):
+        """Export the searches run inside the block as the trees of problem x."""
+        trace = SearchTrace(self, problem or problem_key(x))
+        trace.root(x)
+        try:
+            with extra_listener(trace.on_event):
+                yield trace
+        finally:
+            trace.finish()
+
+
+class SearchTrace:
+    """The part of one problem's trace still waiting on the search: unscored nodes and the expansions they came from."""
+
+    def __init__(self, writer, problem):
+        self.writer = writer
+        self.problem = problem
+        self.pending = {}
+        self.expansions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, type, node, parent, depth, thought, cost=None):
+        cost = cost or {}
+        return {"type": type, "problem": self.problem, "node": node, "parent": parent, "depth": depth, "thought": thought, "score": None, "latency": cost.get("latency", 0.0), "prompt_tokens": cost.get("prompt_tokens", 0), "completion_tokens": cost.get("completion_tokens", 0), "time": time.time()}
+
+    def root(self, x):
+        self.writer.write(self.record("node", 0, None, 0, x))
+
+    def on_event(self, event):
+        kind = event["type"]
+        if kind == "expanded" and event["node"] is not None:
+            with self._lock:
+                self.expansions[event["node"]] = event
+                if len(self.expansions) > MAX_OPEN_EXPANSIONS:
+                    self.expansions.popitem(last=False)
+        elif kind == "node":
+            with self._lock:
+                expansion = self.expansions.get(event["parent"])
+                cost = None
+                if expansion is not None:
+                    # the generate call is charged evenly to the thoughts it returned
+                    n = max(1, expansion["thoughts"])
+                    cost = {key: expansion[key] / n for key in ("latency", "prompt_tokens", "completion_tokens")}
+                self.pending[event["node"]] = self.record("node", event["node"], event["parent"], event["depth"], event["thought"], cost)
+        elif kind == "score" and event["node"] is not None:
+            with self._lock:
+                record = self.pending.pop(event["node"], None)
+            if record is not None:
+                record["score"] = event["value"]
+                for key in ("latency", "prompt_tokens", "completion_tokens"):
+                    record[key] += event.get(key, 0)
+                self.writer.write(record)
+        elif kind == "answer":
+            with self._lock:
+                expansion = self.expansions.pop(event["node"], None)
+            cost = None if expansion is None else {key: expansion[key] for key in ("latency", "prompt_tokens", "completion_tokens")}
+            self.writer.write(self.record("answer", None, event["node"], event["depth"], " ".join(event["thoughts"]), cost))
+
+    def finish(self):
+        # nodes the search never scored, e.g. when it stopped early
+        with self._lock:
+            pending, self.pending = self.pending, {}
+            self.expansions.clear()
+        for record in pending.values():
+            self.writer.write(record)
+        self.writer.flush()
+
+
+def tracing(trace, x):
+    return contextlib.nullcontext() if trace is None else trace.recording(x)
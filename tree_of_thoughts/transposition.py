@@ -0,0 +1,86 @@
+import hashlib
+import re
+
+from tree_of_thoughts.cache import LRUCache
+from tree_of_thoughts.nodes import state_text
+
+
+def normalize_text(text):
+    # case, punctuation and spacing differences don't make a different state
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+
+
+def reusable_values(model):
+    # a vote only ranks the states it was cast among, so it can't be reused for another set
+    return getattr(model, 'evaluation_strategy', 'value') != 'vote'
+
+
+class TranspositionTable:
+    """
+    Values and expansions of search states keyed on a fingerprint of their normalized text, so a
+    state reached again (through another path, at another depth or in a later solve attempt)
+    costs no further model calls. evaluate() also merges states sharing a fingerprint, so only
+    one of them is sent to the model.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.values = LRUCache(maxsize)
+        self.expansions = LRUCache(maxsize)
+
+    def fingerprint(self, state):
+        return hashlib.sha1(normalize_text(state_text(state)).encode("utf-8")).digest()
+
+    def merge(self, states):
+        """Drop states whose fingerprint repeats an earlier state's, keeping the first."""
+        unique = {}
+        for state in states:
+            unique.setdefault(self.fingerprint(state), state)
+        return list(unique.values())
+
+    def generate(self, state, k, compute):
+        return list(self.expansions.get_or_compute((self.fingerprint(state), k), lambda: tuple(compute())))
+
+    async def agenerate(self, state, k, compute):
+        key = (self.fingerprint(state), k)
+        thoughts = self.expansions.get(key)
+        if thoughts is None:
+            thoughts = tuple(await compute())
+            self.expansions.put(key, thoughts)
+        return list(thoughts)
+
+    def prepare(self, states, reuse):
+        keys = {state: self.fingerprint(state) for state in states}
+        known, missing = {}, {}
+        for state, key in keys.items():
+            if key in known or key in missing:
+                continue
+            value = self.values.get(key) if reuse else None
+            if value is None:
+                missing[key] = state
+            else:
+                known[key] = value
+        return keys, known, list(missing.values())
+
+    def complete(self, keys, known, missing, computed, reuse):
+        for state in missing:
+            known[keys[state]] = computed[state]
+            if reuse:
+                self.values.put(keys[state], computed[state])
+        return {state: known[key] for state, key in keys.items()}
+
+    def evaluate(self, states, compute, reuse=True):
+        keys, known, missing = self.prepare(states, reuse)
+        computed = compute(missing) if missing else {}
+        return self.complete(keys, known, missing, computed, reuse)
+
+    async def aevaluate(self, states, compute, reuse=True):
+        keys, known, missing = self.prepare(states, reuse)
+        computed = await compute(missing) if missing else {}
+        return self.complete(keys, known, missing, computed, reuse)
+
+    def clear(self):
+        self.values.clear()
+        self.expansions.clear()
+
+    def stats(self):
+        return {"values": self.values.stats(), "expansions": self.expansions.stats()}
@@ -1,10 +1,31 @@
+import asyncio
 import concurrent.futures
+import heapq
+import itertools
+import math
 from abc import ABC, abstractmethod
-import openai
 import os
+import queue
 import re
+import threading
 import time
-import streamlit as st
+
+from tree_of_thoughts.cache import LRUCache, ResponseCache
+from tree_of_thoughts.checkpoint import Checkpointer
+from tree_of_thoughts.client import OpenAIClient
+from tree_of_thoughts.context import bind_context
+from tree_of_thoughts.dedup import NearDuplicateFilter
+from tree_of_thoughts.events import SearchStopped, check_stopped, emit, listening, search_listener, stop_on
+from tree_of_thoughts.mcts import MonteCarloTreeSearch
+from tree_of_thoughts.metrics import default_metrics, measure_calls, search_scope, state_id
+from tree_of_thoughts.nodes import ThoughtNode, state_text
+from tree_of_thoughts.progress import SearchProgress
+from tree_of_thoughts.ratelimit import estimate_tokens, get_rate_limiter, retry_after_seconds
+from tree_of_thoughts.reporting import report
+from tree_of_thoughts.retry import DeadlineExceeded, RetryPolicy, deadline_scope
+from tree_of_thoughts.scheduler import FairScheduler, acall_slot, call_slot, scheduled, search_workers
+from tree_of_thoughts.traces import tracing
+from tree_of_thoughts.transposition import TranspositionTable, reusable_values
 
 class AbstractLanguageModel(ABC):
     @abstractmethod
@@ -15,6 +36,15 @@ class AbstractLanguageModel(ABC):
     def evaluate_states(self, states):
         pass
 
+    async def agenerate_thoughts(self, state, k):
+        # models without a native async client run the blocking call on the default executor
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, bind_context(self.generate_thoughts), state, k)
+
+    async def aevaluate_states(self, states):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, bind_context(self.evaluate_states), states)
+
 
 class CustomLanguageModel(AbstractLanguageModel):
     def __init__(self, model):
@@ -28,28 +58,30 @@ class CustomLanguageModel(AbstractLanguageModel):
         #implement state evaluation logic using self.model
         pass
 class OpenAILanguageModel(AbstractLanguageModel):
-    def __init__(self, api_key, strategy="cot", evaluation_strategy="value", api_base="", api_model="", enable_ReAct_prompting=True):
-        if api_key == "" or api_key == None:
-            api_key = os.environ.get("OPENAI_API_KEY", "")
-        if api_key != "":
-            openai.api_key = api_key
-        else:
-            raise Exception("Please provide OpenAI API key")
-
-        if api_base == ""or api_base == None:
-            api_base = os.environ.get("OPENAI_API_BASE", "")  # if not set, use the default base path of "https://api.openai.com/v1"
-        if api_base != "":
-            # e.g. https://api.openai.com/v1/ or your custom url
-            openai.api_base = api_base
-            print(f'Using custom api_base {api_base}')
-            
+    def __init__(self, api_key, strategy="cot", evaluation_strategy="value", api_base="", api_model="", enable_ReAct_prompting=True, value_batch_size=8, response_cache=None, rate_limiter=None, retry_policy=None, client=None, pool_size=None, metrics=None):
+        if client is None:
+            if api_key == "" or api_key == None:
+                api_key = os.environ.get("OPENAI_API_KEY", "")
+            if api_key == "":
+                raise Exception("Please provide OpenAI API key")
+
+            if api_base == ""or api_base == None:
+                api_base = os.environ.get("OPENAI_API_BASE", "")  # if not set, use the default base path of "https://api.openai.com/v1"
+            if api_base != "":
+                # e.g. https://api.openai.com/v1/ or your custom url
+                report("Using custom api_base %s", api_base)
+
+            # each instance owns its endpoint and connection pool, nothing is written to the openai module globals
+            client = OpenAIClient(api_key, api_base, organization=os.environ.get("OPENAI_ORGANIZATION"), pool_size=pool_size)
+        self.client = client
+
         if api_model == "" or api_model == None:
             api_model = os.environ.get("OPENAI_API_MODEL", "")
         if api_model != "":
             self.api_model = api_model
         else:
             self.api_model = "text-davinci-003"
-        print(f'Using api_model {self.api_model}')
+        report("Using api_model %s", self.api_model)
 
         self.use_chat_api = 'gpt' in self.api_model
 
@@ -60,57 +92,227 @@ class OpenAILanguageModel(AbstractLanguageModel):
         
         self.strategy = strategy
         self.evaluation_strategy = evaluation_strategy
+        # flipped off the first time the chat endpoint rejects n>1, after which samples are requested one by one
+        self.chat_n_supported = True
+        # number of states scored per request in 'value' mode, 1 scores every state on its own
+        self.value_batch_size = max(1, value_batch_size)
+
+        # on-disk completion cache shared across runs and processes, a path or a ResponseCache
+        if isinstance(response_cache, str):
+            response_cache = ResponseCache(response_cache)
+        self.response_cache = response_cache
+
+        # limiter shared by every instance using the same api_model unless one is passed in
+        self.rate_limiter = rate_limiter if rate_limiter is not None else get_rate_limiter(self.api_model)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.metrics = metrics if metrics is not None else default_metrics
+
+    def response_cache_key(self, prompt, max_tokens, temperature, k, stop, sample_index):
+        if self.response_cache is None:
+            return None
+        return self.response_cache.make_key(self.api_model, prompt, temperature, max_tokens, k, stop, sample_index)
+
+    def record_call(self, operation, start_time, response=None, retries=0, cache_hit=False, error=None):
+        usage = (response.get('usage') if hasattr(response, 'get') else None) or {}
+        self.metrics.record_model_call(
+            self.api_model,
+            operation,
+            latency=time.time() - start_time,
+            prompt_tokens=usage.get('prompt_tokens', 0),
+            completion_tokens=usage.get('completion_tokens', 0),
+            retries=retries,
+            cache_hit=cache_hit,
+            cache='response' if cache_hit else None,
+            error=f"{type(error).__name__}: {error}" if error is not None else None,
+        )
+
+    def openai_api_call_handler(self, prompt, max_tokens, temperature, k=1, stop=None, sample_index=0, operation="completion"):
+        start_time = time.time()
+        cache_key = self.response_cache_key(prompt, max_tokens, temperature, k, stop, sample_index)
+        if cache_key is not None:
+            response = self.response_cache.get(cache_key)
+            if response is not None:
+                self.record_call(operation, start_time, response, cache_hit=True)
+                return response
+        try:
+            response, retries = self.openai_api_request(prompt, max_tokens, temperature, k, stop)
+        except Exception as e:
+            self.record_call(operation, start_time, error=e)
+            raise
+        self.record_call(operation, start_time, response, retries=retries)
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response)
+        return response
+
+    def usage_tokens(self, response):
+        usage = response.get('usage') if hasattr(response, 'get') else None
+        return usage.get('total_tokens') if usage else None
+
+    def retry_delay(self, error, attempt):
+        if not self.retry_policy.should_retry(error, attempt):
+            raise error
+        import openai
+
+        if isinstance(error, openai.error.RateLimitError):
+            # the limiter's shared cooldown does the waiting, acquire() blocks until it is over
+            sleep_duration = self.rate_limiter.on_rate_limited(retry_after_seconds(error))
+            self.retry_policy.check_deadline(sleep_duration)
+            report("%s, all requests to %s paused for %ss", error, self.api_model, sleep_duration)
+            return 0
+        delay = self.retry_policy.delay(attempt)
+        report("%s: %s, retry %s in %.1fs", type(error).__name__, error, attempt + 1, delay)
+        return delay
 
-    def openai_api_call_handler(self, prompt, max_tokens, temperature, k=1, stop=None):
+    def openai_api_request(self, prompt, max_tokens, temperature, k=1, stop=None):
+        estimated_tokens = estimate_tokens(prompt, max_tokens, k)
+        attempt = 0
         while True:
+            self.retry_policy.check_deadline()
             try:
-                if self.use_chat_api:
-                    messages = [
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ]
-                    response = openai.ChatCompletion.create(
-                        model=self.api_model,
-                        messages=messages,
-                        max_tokens=max_tokens,
-                        temperature=temperature,
-                    )
-                else:
-                    response = openai.Completion.create(
-                        engine=self.api_model,
-                        prompt=prompt,
-                        n=k,
-                        max_tokens=max_tokens,
-                        stop=stop,
-                        temperature=temperature,
-                    )
-                return response
-            except openai.error.RateLimitError as e:
-                sleep_duratoin = os.environ.get("OPENAI_RATE_TIMEOUT", 30)
-                print(f'{str(e)}, sleep for {sleep_duratoin}s, set it by env OPENAI_RATE_TIMEOUT')
-                time.sleep(sleep_duratoin)
+                with self.rate_limiter.acquire(estimated_tokens):
+                    response = self.openai_api_create(prompt, max_tokens, temperature, k, stop, self.retry_policy.call_timeout())
+                self.rate_limiter.on_success(estimated_tokens, self.usage_tokens(response))
+                return response, attempt
+            except Exception as e:
+                time.sleep(self.retry_delay(e, attempt))
+                attempt += 1
+
+    def openai_api_create(self, prompt, max_tokens, temperature, k=1, stop=None, request_timeout=None):
+        if self.use_chat_api:
+            messages = [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+            response = self.client.chat_completion(
+                model=self.api_model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                n=k,
+                stop=stop,
+                request_timeout=request_timeout,
+            )
+        else:
+            response = self.client.completion(
+                model=self.api_model,
+                prompt=prompt,
+                n=k,
+                max_tokens=max_tokens,
+                stop=stop,
+                temperature=temperature,
+                request_timeout=request_timeout,
+            )
+        return response
 
     def openai_choice2text_handler(self, choice):
         if self.use_chat_api:
             text = choice['message']['content']
         else:
-            text = choice.text.strip()
+            text = choice['text'].strip()
         return text
 
-    def generate_thoughts(self, state, k):
-        state_text = ' '.join(state)
-        
-        prompt = f"Given the current state of reasoning: '{state_text}', generate {1} coherent thoughts to continue the reasoning process:"
+    def thought_prompt(self, state):
+        prompt = f"Given the current state of reasoning: '{state_text(state)}', generate {1} coherent thoughts to continue the reasoning process:"
         prompt += self.ReAct_prompt
+        return prompt
+
+    def value_prompt(self, state):
+        return f"Given the current state of reasoning: '{state_text(state)}', evaluate its value as a float between 0 and 1, and NOTHING ELSE:"
+
+    def value_batch_prompt(self, states):
+        states_text = '\n'.join([f"{i}. {state_text(state)}" for i, state in enumerate(states, 1)])
+        return f"Given the following numbered states of reasoning, evaluate the value of each state as a float between 0 and 1:\n{states_text}\n\nAnswer with exactly one line per state in the format 'number: value', and NOTHING ELSE:"
+
+    def vote_prompt(self, states):
+        states_text = '\n'.join([state_text(state) for state in states])
+        return f"Given the following states of reasoning, vote for the best state:\n{states_text}\n\nVote, and NOTHING ELSE:"
+
+    def parse_value(self, response):
+        try:
+            value_text = self.openai_choice2text_handler(response['choices'][0])
+            report("Value text %s", value_text)
+            value = float(value_text)
+            report("value: %s", value)
+        except ValueError:
+            value = 0  # Assign a default value if the conversion fails
+        return value
+
+    def parse_value_batch(self, response, n):
+        # returns one value per state in prompt order, or None if any state is missing from the answer
+        text = self.openai_choice2text_handler(response['choices'][0])
+        values = {}
+        for match in re.finditer(r'^\s*(\d+)\s*[:.)-]\s*([01](?:\.\d+)?|\.\d+)', text, re.MULTILINE):
+            index = int(match.group(1))
+            if 1 <= index <= n and index not in values:
+                values[index] = float(match.group(2))
+        if len(values) != n:
+            report("Could not parse %s values from batch value text %s", n, text)
+            return None
+        return [values[i] for i in range(1, n + 1)]
+
+    def value_batches(self, states):
+        states = list(states)
+        return [states[i:i + self.value_batch_size] for i in range(0, len(states), self.value_batch_size)]
+
+    def evaluate_value_batch(self, batch):
+        if len(batch) > 1:
+            response = self.openai_api_call_handler(self.value_batch_prompt(batch), 10 * len(batch), 1, operation='value_batch')
+            values = self.parse_value_batch(response, len(batch))
+            if values is not None:
+                return dict(zip(batch, values))
+        # single state, or the batch answer was unusable: score only this batch one state at a time
+        return {state: self.parse_value(self.openai_api_call_handler(self.value_prompt(state), 10, 1, operation='value')) for state in batch}
+
+    def parse_vote(self, response, states):
+        best_state_text = self.openai_choice2text_handler(response['choices'][0])
+        report("Best state text: %s", best_state_text)
+        best_state = best_state_text.split()
+        return {state: 1 if state_text(state).split() == best_state else 0 for state in states}
+
+    def is_n_rejected(self, error):
+        import openai
+
+        # only a refusal of n itself; content filters and other bad requests must not turn batching off
+        if not isinstance(error, openai.error.InvalidRequestError):
+            return False
+        if error.param is not None:
+            return error.param == 'n'
+        return re.search(r"\bn\b", str(error)) is not None
+
+    def generate_chat_samples(self, prompt, k):
+        # ask for all k samples in one request and top up with single-sample calls only when
+        # the endpoint refuses n>1 or returns fewer choices than requested
+        thoughts = []
+        if self.chat_n_supported and k > 1:
+            try:
+                response = self.openai_api_call_handler(prompt, 50, 0.5, k, operation='generate')
+                thoughts = [self.openai_choice2text_handler(choice) for choice in response['choices']]
+            except Exception as e:
+                if not self.is_n_rejected(e):
+                    raise
+                report("Endpoint rejected n=%s, falling back to single-sample chat calls: %s", k, e)
+                self.chat_n_supported = False
+            else:
+                if len(thoughts) < k:
+                    self.chat_n_supported = False
+        missing = range(len(thoughts), k)
+        if missing:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=search_workers(len(missing))) as executor:
+                responses = list(executor.map(bind_context(lambda i: self.openai_api_call_handler(prompt, 50, 0.5, 1, sample_index=i, operation='generate')), missing))
+            thoughts += [self.openai_choice2text_handler(response['choices'][0]) for response in responses]
+        return thoughts
+
+    def generate_thoughts(self, state, k):
+        prompt = self.thought_prompt(state)
         if self.use_chat_api:
             new_prompt_success = False
             """
             # Try prompt and parse in a single shot to save tokens (but if we fail, we end up spending more tokens)
             new_prompt = prompt + "Thought string should be output in a format that can be parsed into python array in format [xxx,xxx,xxx]"
             response = self.openai_api_call_handler(new_prompt, 100 * k, 0.5, 1)
-            text = self.openai_choice2text_handler(response.choices[0])
+            text = self.openai_choice2text_handler(response['choices'][0])
             re_parse = re.search(r'\[(.*?)\]', text)
             if re_parse:
                 thoughts_str = re_parse.group(1)
@@ -118,73 +320,263 @@ class OpenAILanguageModel(AbstractLanguageModel):
                     thoughts = thoughts_str.split(',')
                     new_prompt_success = len(thoughts) == k 
                     if not new_prompt_success:
-                        print(f"Fall back to multi-prompt for chat-completion due to parse fail {text}")
+                        report("Fall back to multi-prompt for chat-completion due to parse fail %s", text)
 
             """
             if not new_prompt_success:
-                thoughts = []
-                for _ in range(k):
-                    response = self.openai_api_call_handler(prompt, 50, 0.5, k)
-                    text = self.openai_choice2text_handler(response.choices[0])
-                    thoughts += [text]
+                thoughts = self.generate_chat_samples(prompt, k)
             
         else:
-            response = self.openai_api_call_handler(prompt, 50, 0.5, k)
-            thoughts = [self.openai_choice2text_handler(choice) for choice in response.choices]
+            response = self.openai_api_call_handler(prompt, 50, 0.5, k, operation='generate')
+            thoughts = [self.openai_choice2text_handler(choice) for choice in response['choices']]
         # print(thoughts)
         #print(f"Generated thoughts: {thoughts}")
-        st.code(f"Generated thoughts: {thoughts}")  # Streamlit print statement
+        report("Generated thoughts: %s", thoughts)
         return thoughts
 
     def evaluate_states(self, states):
         if self.evaluation_strategy == 'value':
             state_values = {}
-            for state in states:
-                state_text = ' '.join(state)
-                prompt = f"Given the current state of reasoning: '{state_text}', evaluate its value as a float between 0 and 1, and NOTHING ELSE:"
-                response = self.openai_api_call_handler(prompt, 10, 1)
-                try:
-                    value_text = self.openai_choice2text_handler(response.choices[0])
-                    print(f"Value text {value_text}")
-                    value = float(value_text)
-                    print(f"value: {value}")
-                except ValueError:
-                    value = 0  # Assign a default value if the conversion fails
-                state_values[state] = value
+            for batch in self.value_batches(states):
+                state_values.update(self.evaluate_value_batch(batch))
             return state_values
 
         elif self.evaluation_strategy == 'vote':
-            states_text = '\n'.join([' '.join(state) for state in states])
-            prompt = f"Given the following states of reasoning, vote for the best state:\n{states_text}\n\nVote, and NOTHING ELSE:"
-            response = self.openai_api_call_handler(prompt, 50, 1)
-            best_state_text = self.openai_choice2text_handler(response.choices[0])
-            print(f"Best state text: {best_state_text}")
-            best_state = tuple(best_state_text.split())
-            return {state: 1 if state == best_state else 0 for state in states}
+            response = self.openai_api_call_handler(self.vote_prompt(states), 50, 1, operation='vote')
+            return self.parse_vote(response, states)
 
         else:
             raise ValueError("Invalid evaluation strategy. Choose 'value' or 'vote'.")
 
 class OptimizedOpenAILanguageModel(OpenAILanguageModel):
-    def __init__(self, api_key, strategy="cot", evaluation_strategy="value", cache_enabled=True, api_base="", api_model="", enable_ReAct_prompting=True):
-        super().__init__(api_key, strategy, evaluation_strategy, api_base, api_model, enable_ReAct_prompting)
+    def __init__(self, api_key, strategy="cot", evaluation_strategy="value", cache_enabled=True, api_base="", api_model="", enable_ReAct_prompting=True, value_batch_size=8, cache_size=1024, response_cache=None, rate_limiter=None, retry_policy=None, client=None, pool_size=None, metrics=None):
+        super().__init__(api_key, strategy, evaluation_strategy, api_base, api_model, enable_ReAct_prompting, value_batch_size, response_cache, rate_limiter, retry_policy, client, pool_size, metrics)
         self.cache_enabled = cache_enabled
-        self.thought_cache = {}
-        self.state_evaluation_cache = {}
+        self.thought_cache = LRUCache(cache_size)
+        self.state_evaluation_cache = LRUCache(cache_size)
+
+    def thought_cache_key(self, state, k):
+        return (state_text(state), k, self.api_model, self.strategy, self.ReAct_prompt)
+
+    def state_cache_key(self, state):
+        return (state_text(state), self.api_model, self.evaluation_strategy)
+
+    def generate_thoughts(self, state, k):
+        if not self.cache_enabled:
+            return super().generate_thoughts(state, k)
+        key = self.thought_cache_key(state, k)
+        computed = []
+
+        def compute():
+            computed.append(True)
+            return tuple(super(OptimizedOpenAILanguageModel, self).generate_thoughts(state, k))
+
+        thoughts = self.thought_cache.get_or_compute(key, compute)
+        if not computed:
+            self.record_memory_hit('generate')
+        return list(thoughts)
+
+    def evaluate_states(self, states):
+        if not self.cache_enabled:
+            return super().evaluate_states(states)
+
+        if self.evaluation_strategy == 'vote':
+            # a vote depends on the whole candidate set, so the set is the key
+            key = (frozenset(self.state_cache_key(state) for state in states), 'vote')
+            computed = []
+
+            def compute():
+                computed.append(True)
+                # keyed by text: the states of a later call are other, equal-text nodes
+                votes = super(OptimizedOpenAILanguageModel, self).evaluate_states(states)
+                return {self.state_cache_key(state): vote for state, vote in votes.items()}
+
+            votes = self.state_evaluation_cache.get_or_compute(key, compute)
+            if not computed:
+                self.record_memory_hit('vote')
+            return {state: votes[self.state_cache_key(state)] for state in states}
+
+        state_values = {}
+        missing = []
+        for state in states:
+            value = self.state_evaluation_cache.get(self.state_cache_key(state))
+            if value is None:
+                missing.append(state)
+            else:
+                self.record_memory_hit('value')
+                state_values[state] = value
+        if missing:
+            for state, value in super().evaluate_states(missing).items():
+                self.state_evaluation_cache.put(self.state_cache_key(state), value)
+                state_values[state] = value
+        return state_values
+
+    def record_memory_hit(self, operation):
+        self.metrics.record_model_call(self.api_model, operation, cache_hit=True, cache='memory')
+
+    def cache_stats(self):
+        return {"thoughts": self.thought_cache.stats(), "evaluations": self.state_evaluation_cache.stats()}
 
     def parallel_generate_thoughts(self, states, k):
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            thoughts = list(executor.map(lambda state: self.generate_thoughts(state, k), states))
-            print(f"Parallel generated thoughts: {thoughts}")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.client.pool_size) as executor:
+            thoughts = list(executor.map(bind_context(lambda state: self.generate_thoughts(state, k)), states))
+            report("Parallel generated thoughts: %s", thoughts)
         return thoughts
 
     def parallel_evaluate_states(self, states):
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            state_values = list(executor.map(self.evaluate_states, states))
-            print(f"Parallel evaluated state values: {state_values}")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.client.pool_size) as executor:
+            state_values = list(executor.map(bind_context(self.evaluate_states), states))
+            report("Parallel evaluated state values: %s", state_values)
         return state_values
     
 
+class AsyncOpenAILanguageModel(OpenAILanguageModel):
+    """
+    OpenAI model with native asyncio calls. Every request goes through a semaphore of
+    max_concurrency permits, so a search can fan out a whole level at once without
+    flooding the endpoint.
+    """
+
+    def __init__(self, api_key, strategy="cot", evaluation_strategy="value", api_base="", api_model="", enable_ReAct_prompting=True, value_batch_size=8, response_cache=None, rate_limiter=None, retry_policy=None, client=None, max_concurrency=16, metrics=None):
+        super().__init__(api_key, strategy, evaluation_strategy, api_base, api_model, enable_ReAct_prompting, value_batch_size, response_cache, rate_limiter, retry_policy, client, pool_size=max_concurrency, metrics=metrics)
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._semaphore_loop = None
+
+    def get_semaphore(self):
+        # asyncio primitives belong to one event loop, so rebuild it when solve runs under a new one
+        loop = asyncio.get_event_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def aclose(self):
+        # release the pooled aiohttp connections of the running event loop
+        await self.client.aclose()
+
+    async def aopenai_api_call_handler(self, prompt, max_tokens, temperature, k=1, stop=None, sample_index=0, operation="completion"):
+        start_time = time.time()
+        cache_key = self.response_cache_key(prompt, max_tokens, temperature, k, stop, sample_index)
+        loop = asyncio.get_event_loop()
+        if cache_key is not None:
+            response = await loop.run_in_executor(None, self.response_cache.get, cache_key)
+            if response is not None:
+                self.record_call(operation, start_time, response, cache_hit=True)
+                return response
+        try:
+            response, retries = await self.aopenai_api_request(prompt, max_tokens, temperature, k, stop)
+        except Exception as e:
+            self.record_call(operation, start_time, error=e)
+            raise
+        self.record_call(operation, start_time, response, retries=retries)
+        if cache_key is not None:
+            await loop.run_in_executor(None, self.response_cache.put, cache_key, response)
+        return response
+
+    async def aopenai_api_request(self, prompt, max_tokens, temperature, k=1, stop=None):
+        estimated_tokens = estimate_tokens(prompt, max_tokens, k)
+        attempt = 0
+        while True:
+            self.retry_policy.check_deadline()
+            try:
+                async with self.get_semaphore(), self.rate_limiter.aacquire(estimated_tokens):
+                    response = await self.aopenai_api_create(prompt, max_tokens, temperature, k, stop, self.retry_policy.call_timeout())
+                self.rate_limiter.on_success(estimated_tokens, self.usage_tokens(response))
+                return response, attempt
+            except Exception as e:
+                await asyncio.sleep(self.retry_delay(e, attempt))
+                attempt += 1
+
+    async def aopenai_api_create(self, prompt, max_tokens, temperature, k=1, stop=None, request_timeout=None):
+        if self.use_chat_api:
+            messages = [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+            response = await self.client.achat_completion(
+                model=self.api_model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                n=k,
+                stop=stop,
+                request_timeout=request_timeout,
+            )
+        else:
+            response = await self.client.acompletion(
+                model=self.api_model,
+                prompt=prompt,
+                n=k,
+                max_tokens=max_tokens,
+                stop=stop,
+                temperature=temperature,
+                request_timeout=request_timeout,
+            )
+        return response
+
+    async def agenerate_chat_samples(self, prompt, k):
+        thoughts = []
+        if self.chat_n_supported and k > 1:
+            try:
+                response = await self.aopenai_api_call_handler(prompt, 50, 0.5, k, operation='generate')
+                thoughts = [self.openai_choice2text_handler(choice) for choice in response['choices']]
+            except Exception as e:
+                if not self.is_n_rejected(e):
+                    raise
+                report("Endpoint rejected n=%s, falling back to single-sample chat calls: %s", k, e)
+                self.chat_n_supported = False
+            else:
+                if len(thoughts) < k:
+                    self.chat_n_supported = False
+        responses = await asyncio.gather(*(self.aopenai_api_call_handler(prompt, 50, 0.5, 1, sample_index=i, operation='generate') for i in range(len(thoughts), k)))
+        return thoughts + [self.openai_choice2text_handler(response['choices'][0]) for response in responses]
+
+    async def agenerate_thoughts(self, state, k):
+        prompt = self.thought_prompt(state)
+        if self.use_chat_api:
+            thoughts = await self.agenerate_chat_samples(prompt, k)
+        else:
+            response = await self.aopenai_api_call_handler(prompt, 50, 0.5, k, operation='generate')
+            thoughts = [self.openai_choice2text_handler(choice) for choice in response['choices']]
+        report("Generated thoughts: %s", thoughts)
+        return thoughts
+
+    async def aevaluate_value_batch(self, batch):
+        if len(batch) > 1:
+            response = await self.aopenai_api_call_handler(self.value_batch_prompt(batch), 10 * len(batch), 1, operation='value_batch')
+            values = self.parse_value_batch(response, len(batch))
+            if values is not None:
+                return dict(zip(batch, values))
+        responses = await asyncio.gather(*(self.aopenai_api_call_handler(self.value_prompt(state), 10, 1, operation='value') for state in batch))
+        return {state: self.parse_value(response) for state, response in zip(batch, responses)}
+
+    async def aevaluate_states(self, states):
+        if self.evaluation_strategy == 'value':
+            state_values = {}
+            for batch_values in await asyncio.gather(*(self.aevaluate_value_batch(batch) for batch in self.value_batches(states))):
+                state_values.update(batch_values)
+            return state_values
+
+        elif self.evaluation_strategy == 'vote':
+            response = await self.aopenai_api_call_handler(self.vote_prompt(states), 50, 1, operation='vote')
+            return self.parse_vote(response, states)
+
+        else:
+            raise ValueError("Invalid evaluation strategy. Choose 'value' or 'vote'.")
+
+
+def depth_aware_heuristic(weight=0.1):
+    """
+    Best-first priority that adds weight * depth / T to a state's value, so among similarly
+    valued states the ones closer to a full solution are expanded first.
+    """
+    def heuristic(value, depth, T):
+        return value + weight * depth / max(1, T)
+    return heuristic
+
 
 class TreeofThoughts:
     """
@@ -218,47 +610,376 @@ class TreeofThoughts:
     execute the chosen search algo with the input problem, thought generator, and state evaluator, and other required params
     """
 
-    def __init__(self, model, search_algorithm):
+    def __init__(self, model, search_algorithm, max_concurrency=16, batch_siblings=False, prefetch=False, transpositions=None, diversity_threshold=None):
         self.model = model
         self.search_algorithm = search_algorithm
+        self.max_concurrency = max_concurrency
+        # DFS: score the k children of a state together and visit them best first
+        self.batch_siblings = batch_siblings
+        # DFS: score the children concurrently and start expanding the first one that passes the
+        # thresholds while its siblings are still being scored
+        self.prefetch = prefetch
+        # True for a fresh TranspositionTable, or a table to share with other trees; it outlives
+        # a single search, so the retries in solve reuse what earlier attempts learned
+        self.transpositions = TranspositionTable() if transpositions is True else transpositions
+        # siblings whose thoughts are at least this similar (estimated Jaccard) are dropped before scoring
+        self.diversity_filter = NearDuplicateFilter(diversity_threshold) if diversity_threshold is not None else None
 
-    def solve(self, x, k, T, b, vth, timeout=None):
-        start_time = time.time()
-        if self.search_algorithm == 'BFS':
-            while timeout is None or time.time() - start_time < timeout:
-                result = self.tot_bfs(x, k, T, b)
-                st.code(f"Intermediary BFS result at {time.time() - start_time} seconds: {result}")  # Streamlit print statement
-                if result:
-                    return result
-        elif self.search_algorithm == 'DFS':
-            while timeout is None or time.time() - start_time < timeout:
-                result = self.tot_dfs(x, k, T, vth)
-                st.code(f"Intermediary DFS result at {time.time() - start_time} seconds: {result}")  # Streamlit print statement
-                if result:
-                    return result
+    def solve(self, x, k, T, b, vth, timeout=None, max_expansions=None, heuristic=None, iterations=None, time_budget=None, checkpoint=None, trace=None):
+        search = self.search_function(x, k, T, b, vth, max_expansions, heuristic, iterations, time_budget)
+        return self.run_search(x, search, timeout, checkpoint, trace, dict(k=k, T=T, b=b, vth=vth, max_expansions=max_expansions, iterations=iterations, time_budget=time_budget))
+
+    def search_function(self, x, k, T, b, vth, max_expansions=None, heuristic=None, iterations=None, time_budget=None, dfs_options=None, asynchronous=False):
+        """The search of self.search_algorithm for x, as a function of the SearchProgress it continues."""
+        dfs_options = dfs_options or {}
+        if asynchronous:
+            searches = {
+                'BFS': lambda progress: self.atot_bfs(x, k, T, b, progress=progress),
+                'DFS': lambda progress: self.atot_dfs(x, k, T, vth, **dfs_options, progress=progress),
+                'BestFirst': lambda progress: self.atot_best_first(x, k, T, vth, max_expansions, heuristic, progress=progress),
+                'MCTS': lambda progress: self.atot_mcts(x, k, T, vth, iterations, time_budget, progress=progress),
+            }
         else:
-            raise ValueError("Invalid search algorithm. Choose 'BFS' or 'DFS'.")
+            searches = {
+                'BFS': lambda progress: self.tot_bfs(x, k, T, b, progress=progress),
+                'DFS': lambda progress: self.tot_dfs(x, k, T, vth, **dfs_options, progress=progress),
+                'BestFirst': lambda progress: self.tot_best_first(x, k, T, vth, max_expansions, heuristic, progress=progress),
+                'MCTS': lambda progress: self.tot_mcts(x, k, T, vth, iterations, time_budget, progress=progress),
+            }
+        if self.search_algorithm not in searches:
+            raise ValueError("Invalid search algorithm. Choose 'BFS', 'DFS', 'BestFirst' or 'MCTS'.")
+        return searches[self.search_algorithm]
+
+    def run_search(self, x, search, timeout, checkpoint, trace, args):
+        start_time = time.time()
+        # the retries below pick up the tree explored so far instead of starting over
+        progress = self.start_progress(x, checkpoint, args)
+        try:
+            with deadline_scope(timeout), tracing(trace, x):
+                while (timeout is None or time.time() - start_time < timeout) and progress.retry():
+                    result = search(progress)
+                    report("Intermediary %s result at %s seconds: %s", self.search_algorithm, time.time() - start_time, result)
+                    if result:
+                        return result
+        except DeadlineExceeded as e:
+            report("Stopped searching after %s seconds: %s", time.time() - start_time, e)
+        finally:
+            progress.close()
+
+    async def arun_search(self, x, search, timeout, checkpoint, trace, args):
+        start_time = time.time()
+        progress = self.start_progress(x, checkpoint, args)
+        try:
+            with deadline_scope(timeout), tracing(trace, x):
+                while (timeout is None or time.time() - start_time < timeout) and progress.retry():
+                    result = await search(progress)
+                    report("Intermediary %s result at %s seconds: %s", self.search_algorithm, time.time() - start_time, result)
+                    if result:
+                        return result
+        except DeadlineExceeded as e:
+            report("Stopped searching after %s seconds: %s", time.time() - start_time, e)
+        finally:
+            progress.close()
+
+    def start_progress(self, x, checkpoint, args):
+        if checkpoint is None:
+            return SearchProgress(x)
+        checkpointer = checkpoint if isinstance(checkpoint, Checkpointer) else Checkpointer(checkpoint)
+        return checkpointer.start(x, self.search_algorithm, args, self.model)
+
+    def resume(self, path, timeout=None, **options):
+        """
+        Continue the solve checkpointed at path (a file or a Checkpointer) with the problem and
+        arguments stored there. options override them; a heuristic has to be passed again.
+        """
+        problem, args = self.checkpointed_args(path, options)
+        return self.solve(problem, timeout=timeout, checkpoint=path, **args)
+
+    async def aresume(self, path, timeout=None, **options):
+        problem, args = self.checkpointed_args(path, options)
+        return await self.asolve(problem, timeout=timeout, checkpoint=path, **args)
+
+    def checkpointed_args(self, path, options):
+        header, _ = (path if isinstance(path, Checkpointer) else Checkpointer(path)).read()
+        if header is None:
+            raise FileNotFoundError(f"no checkpoint at {getattr(path, 'path', path)}")
+        return header["problem"], {**header["args"], **options}
+
+    def solve_iter(self, x, k, T, b, vth, timeout=None, **options):
+        """
+        Run solve on a worker thread and yield its events as they happen: "expanded" for every
+        generate call, "node" for every new state, "score" for every evaluation, "best" when a
+        score beats the best so far, "level" when a BFS level is done, "answer" for every final
+        answer generated and finally "result".
+        Expansions and scores carry the latency and tokens of their model calls. Leaving the
+        loop early stops the search at its next model call.
+        """
+        events = queue.Queue()
+        stop = threading.Event()
+
+        def run():
+            with search_listener(events.put, stop):
+                try:
+                    events.put({"type": "result", "result": self.solve(x, k, T, b, vth, timeout, **options)})
+                except SearchStopped:
+                    pass
+                except BaseException as e:
+                    events.put({"type": "error", "error": e})
+                finally:
+                    events.put(None)
+
+        threading.Thread(target=run, name="tree-of-thoughts-solve", daemon=True).start()
+        best = None
+        try:
+            for event in iter(events.get, None):
+                streamed, best = self.stream_event(event, best)
+                yield from streamed
+        finally:
+            stop.set()
+
+    def stream_event(self, event, best):
+        # returns the events to pass on and the best score so far
+        if event["type"] == "error":
+            raise event["error"]
+        if event["type"] == "score" and (best is None or event["value"] > best["value"]):
+            best = {**event, "type": "best"}
+            return (event, best), best
+        return (event,), best
+
+    def solve_many(self, problems, k, T, b, vth, timeout=None, max_problems=None, scheduler=None, return_exceptions=False, **options):
+        """
+        Solve every problem of an iterable and yield (index, result) pairs as the problems finish.
 
-    def tot_bfs(self, x, k, T, b):
-        S0 = {x}
+        Up to max_problems (2 * max_concurrency by default) are searched at once, and the model
+        calls of all of them share the max_concurrency slots of one FairScheduler (pass scheduler
+        to share it between several calls), handed out round-robin across the problems waiting.
+        The model's rate limiter applies to all of them as usual. With return_exceptions a
+        problem that failed yields its exception instead of raising it. checkpoint may be a
+        function of (index, problem) giving each problem its own checkpoint path. Each search
+        starts at most max_concurrency // max_problems threads of its own (at least one).
+        """
+        scheduler = scheduler or FairScheduler(self.max_concurrency)
+        max_problems = max_problems or 2 * self.max_concurrency
+        problems = enumerate(problems)
+        # the searches' own pools (MCTS rollouts, DFS prefetch, chat samples) get their share of
+        # the scheduler's slots, more threads per search would only queue for them
+        workers = max(1, scheduler.max_concurrency // max_problems)
+        stop = threading.Event()
+
+        def run(index, x):
+            solve_options = options
+            if callable(options.get("checkpoint")):
+                solve_options = dict(options, checkpoint=options["checkpoint"](index, x))
+            with scheduled(scheduler, index, workers), stop_on(stop):
+                try:
+                    return index, self.solve(x, k, T, b, vth, timeout, **solve_options)
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    return index, e
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_problems, thread_name_prefix="tree-of-thoughts-solve-many")
+        pending = set()
+        try:
+            while True:
+                for index, x in itertools.islice(problems, max_problems - len(pending)):
+                    pending.add(executor.submit(bind_context(run), index, x))
+                if not pending:
+                    break
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            # the problems still being searched stop at their next model call, and are waited
+            # for so none of them keeps spending after solve_many is done
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def tot_bfs(self, x, k, T, b, progress=None):
+        progress = progress or SearchProgress(x)
+        S0 = [progress.root]
         for t in range(1, T + 1):
-            S0_t = {(*s, z) for s in S0 for z in self.model.generate_thoughts(s, k)}
-            Vt = self.model.evaluate_states(S0_t)
-            St = sorted(S0_t, key=lambda s: Vt[s], reverse=True)[:b]
-            S0 = set(St)
-        return self.model.generate_thoughts(max(St, key=lambda s: Vt[s]), 1)
+            # each expansion is recorded as soon as it returns, so a checkpoint keeps the calls
+            # of a level the process didn't finish
+            level = []
+            for s in S0:
+                if progress.expanded(s) is None:
+                    progress.add_expansions([(s, self.generate_thoughts(s, k, t))], lambda states: self.merge_states(states, level))
+                level += progress.expanded(s)
+            S0_t = self.level_states(progress, S0)
+            Vt = progress.scores(S0_t, lambda states: self.evaluate_states(states, t))
+            St = self.select_beam(S0_t, Vt, b)
+            emit("level", depth=t, states=len(S0_t), beam=len(St), best_value=Vt[St[0]] if St else None)
+            if not St:
+                return None
+            S0 = St
+        return self.answer(progress, max(St, key=lambda s: Vt[s]))
+
+    def level_states(self, progress, states):
+        # children of the beam, without the dead ends found by earlier attempts
+        return [child for s in states for child in progress.expanded(s) if not progress.is_exhausted(child)]
+
+    def select_beam(self, states, values, b):
+        return sorted(states, key=lambda s: values[s], reverse=True)[:b]
+
+    # the searches reach the model only through these helpers, which tag the calls with the node
+    # they serve for Metrics and go through the transposition table when there is one
+
+    def merge_states(self, states, known=()):
+        # known: states kept earlier in the same level, which win over the new ones as they
+        # would in one merge of the whole level
+        states = list(dict.fromkeys(states))
+        if self.diversity_filter is not None:
+            states = self.diversity_filter.filter_states(states)
+        if self.transpositions is not None:
+            kept = set(known)
+            states = [s for s in self.transpositions.merge([*known, *states]) if s not in kept]
+        if listening():
+            for s in states:
+                if isinstance(s, ThoughtNode):
+                    emit("node", node=s.index, parent=s.parent, depth=s.depth, thought=s.thought)
+        return states
+
+    def emit_expansion(self, s, depth, thoughts, cost):
+        if listening():
+            emit("expanded", node=s.index if isinstance(s, ThoughtNode) else None, depth=depth, thoughts=len(thoughts), **cost.share(1))
+        return thoughts
+
+    def emit_scores(self, values, depth, cost):
+        if listening():
+            # a batched evaluation is charged evenly to the states in it
+            share = cost.share(len(values))
+            for s, value in values.items():
+                emit("score", node=s.index if isinstance(s, ThoughtNode) else None, depth=depth, value=value, text=state_text(s), **share)
+        return values
+
+    # the model itself is only called here, inside a slot of the solve_many scheduler if any,
+    # and not by a search that was stopped while it waited for the slot
+
+    def call_generate(self, s, k):
+        with call_slot():
+            check_stopped()
+            return self.model.generate_thoughts(s, k)
+
+    def call_evaluate(self, states):
+        with call_slot():
+            check_stopped()
+            return self.model.evaluate_states(states)
 
-    def tot_dfs(self, x, k, T, vth, pruning_threshold=0.5, confidence_threshold=0.9, max_iterations=10, convergence_threshold=0.1, convergence_count=5):
+    async def acall_generate(self, s, k):
+        async with acall_slot():
+            check_stopped()
+            return await self.model.agenerate_thoughts(s, k)
+
+    async def acall_evaluate(self, states):
+        async with acall_slot():
+            check_stopped()
+            return await self.model.aevaluate_states(states)
+
+    def generate_thoughts(self, s, k, depth):
+        check_stopped()
+        with search_scope(depth=depth, node=state_id(s)), measure_calls() as cost:
+            if self.transpositions is None:
+                thoughts = self.call_generate(s, k)
+            else:
+                thoughts = self.transpositions.generate(s, k, lambda: self.call_generate(s, k))
+        return self.emit_expansion(s, depth, thoughts, cost)
+
+    def evaluate_states(self, states, depth):
+        check_stopped()
+        with search_scope(depth=depth), measure_calls() as cost:
+            if self.transpositions is None:
+                values = self.call_evaluate(states)
+            else:
+                values = self.transpositions.evaluate(states, self.call_evaluate, reusable_values(self.model))
+        return self.emit_scores(values, depth, cost)
+
+    def evaluate_state(self, s, depth):
+        with search_scope(node=state_id(s)):
+            return self.evaluate_states([s], depth)[s]
+
+    def answer(self, progress, s):
+        thoughts = progress.answer(s)
+        if thoughts is None:
+            thoughts = progress.answered(s, self.generate_thoughts(s, 1, s.depth + 1))
+            emit("answer", node=s.index, depth=s.depth + 1, thoughts=thoughts)
+        return thoughts
+
+    async def agenerate_thoughts(self, s, k, depth):
+        check_stopped()
+        with search_scope(depth=depth, node=state_id(s)), measure_calls() as cost:
+            if self.transpositions is None:
+                thoughts = await self.acall_generate(s, k)
+            else:
+                thoughts = await self.transpositions.agenerate(s, k, lambda: self.acall_generate(s, k))
+        return self.emit_expansion(s, depth, thoughts, cost)
+
+    async def aevaluate_states(self, states, depth):
+        check_stopped()
+        with search_scope(depth=depth), measure_calls() as cost:
+            if self.transpositions is None:
+                values = await self.acall_evaluate(states)
+            else:
+                values = await self.transpositions.aevaluate(states, self.acall_evaluate, reusable_values(self.model))
+        return self.emit_scores(values, depth, cost)
+
+    async def aevaluate_state(self, s, depth):
+        with search_scope(node=state_id(s)):
+            return (await self.aevaluate_states([s], depth))[s]
+
+    async def aanswer(self, progress, s):
+        thoughts = progress.answer(s)
+        if thoughts is None:
+            thoughts = progress.answered(s, await self.agenerate_thoughts(s, 1, s.depth + 1))
+            emit("answer", node=s.index, depth=s.depth + 1, thoughts=thoughts)
+        return thoughts
+
+    def tot_dfs(self, x, k, T, vth, pruning_threshold=0.5, confidence_threshold=0.9, max_iterations=10, convergence_threshold=0.1, convergence_count=5, progress=None):
         output = []
         iteration_count = 0
         consecutive_convergence_count = 0
         prev_best_value = None
+        progress = progress or SearchProgress(x)
+        # a retry has already searched below every state above pruning_threshold, so it goes on
+        # with the ones pruned as unpromising
+        retrying = progress.attempts > 1
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=search_workers(self.max_concurrency)) if self.prefetch else None
+        prefetched = {}
+
+        def eligible(value):
+            return value > vth and (pruning_threshold is None or retrying or value >= pruning_threshold)
+
+        def expand(s, t):
+            children = progress.expanded(s)
+            if children is None:
+                future = prefetched.pop(s.index, None)
+                thoughts = future.result() if future is not None else self.generate_thoughts(s, k, t)
+                children = progress.add_expansions([(s, thoughts)], self.merge_states)[s]
+            return children
+
+        def score(children, t):
+            return progress.scores(children, lambda states: evaluate(states, t))
+
+        def evaluate(states, t):
+            if not self.prefetch:
+                return self.evaluate_states(states, t)
+            values = {}
+            prefetching = t >= T
+            futures = {executor.submit(bind_context(self.evaluate_state), child, t): child for child in states}
+            for future in concurrent.futures.as_completed(futures):
+                child = futures[future]
+                values[child] = future.result()
+                if not prefetching and eligible(values[child]) and progress.expanded(child) is None:
+                    prefetched[child.index] = executor.submit(bind_context(self.generate_thoughts), child, k, t + 1)
+                    prefetching = True
+            return values
 
         def dfs(s, t):
             nonlocal consecutive_convergence_count, prev_best_value, iteration_count
             if t > T:
-                thought = self.model.generate_thoughts(s, 1)
-                value = self.model.evaluate_states({s})[s]
+                thought = self.answer(progress, s)
+                # s was scored as a child already, the same state isn't valued twice
+                value = progress.scores([s], lambda states: {s: self.evaluate_state(s, t)})[s]
                 output.append((thought, value))
 
                 if confidence_threshold is not None and value >= confidence_threshold:
@@ -278,33 +999,381 @@ class TreeofThoughts:
 
                 return False
 
-            for s_prime in sorted(self.model.generate_thoughts(s, k)):
-                state_value = self.model.evaluate_states({s_prime})[s_prime]
-                if state_value > vth and (pruning_threshold is None or state_value >= pruning_threshold):
-                    if dfs((*s, s_prime), t + 1):
+            if self.batch_siblings or self.prefetch:
+                children = expand(s, t)
+                values = score(children, t)
+                for s_prime in sorted(children, key=lambda child: values[child], reverse=True):
+                    if eligible(values[s_prime]) and dfs(s_prime, t + 1):
+                        return True
+                return False
+
+            children = progress.expanded(s)
+            if children is None:
+                children = progress.add_expansions([(s, sorted(self.generate_thoughts(s, k, t)))], self.merge_states)[s]
+            for s_prime in children:
+                state_value = progress.scores([s_prime], lambda states: {s_prime: self.evaluate_state(s_prime, t)})[s_prime]
+                if eligible(state_value):
+                    if dfs(s_prime, t + 1):
                         return True
 
             return False
 
-        dfs(x, 1)
+        try:
+            dfs(progress.root, 1)
+        finally:
+            if executor is not None:
+                # the prefetches already running are waited for, so none outlives the search
+                executor.shutdown(wait=True, cancel_futures=True)
         return max(output, key=lambda x: x[1]) if output else None
 
+    def tot_best_first(self, x, k, T, vth, max_expansions=None, heuristic=None, progress=None):
+        """
+        Best-first search: always expand the evaluated frontier node with the highest priority
+        (its value, or heuristic(value, depth, T)) and stop at the first node that reaches depth T.
+        Children valued below vth are pruned. With max_expansions set, the search stops after that
+        many expansions and continues the best node found so far. A retry picks up the frontier
+        where the last attempt left it.
+        """
+        progress = progress or SearchProgress(x)
+        frontier = self.best_first_frontier(progress, vth, T, heuristic)
+        expansions = 0
+        best = None
+        while frontier:
+            entry = heapq.heappop(frontier)
+            s = entry[2]
+            if s.depth >= T:
+                best = s
+                break
+            if max_expansions is not None and expansions >= max_expansions:
+                heapq.heappush(frontier, entry)
+                break
+            expansions += 1
+            t = s.depth + 1
+            children = progress.expanded(s)
+            if children is None:
+                children = progress.add_expansions([(s, self.generate_thoughts(s, k, t))], self.merge_states)[s]
+            Vt = progress.scores(children, lambda states: self.evaluate_states(states, t))
+            self.push_children(frontier, progress.order, children, Vt, vth, T, heuristic)
+        if best is None:
+            best = self.best_evaluated(progress)
+        if best is None:
+            return None
+        return self.answer(progress, best)
+
+    def best_first_frontier(self, progress, vth, T, heuristic):
+        if progress.frontier is None:
+            if not progress.values:
+                progress.frontier = [(0.0, next(progress.order), progress.root)]
+            else:
+                # resumed from a checkpoint: the frontier is every scored node that wasn't expanded,
+                # or whose children weren't scored yet
+                progress.frontier = []
+                frontier = [progress.store[index] for index in progress.values if progress.unfinished(index)]
+                self.push_children(progress.frontier, progress.order, frontier, {s: progress.values[s.index] for s in frontier}, vth, T, heuristic)
+        return progress.frontier
+
+    def push_children(self, frontier, order, children, Vt, vth, T, heuristic):
+        for child in children:
+            value = Vt[child]
+            if value < vth:
+                continue
+            priority = heuristic(value, child.depth, T) if heuristic is not None else value
+            heapq.heappush(frontier, (-priority, next(order), child))
+
+    def best_evaluated(self, progress):
+        # deepest of the best valued nodes, used when the budget runs out before depth T
+        values = {progress.store[index]: value for index, value in progress.values.items() if index not in progress.exhausted}
+        if values:
+            return max(values, key=lambda s: (values[s], s.depth))
+        return None if progress.is_exhausted(progress.root) else progress.root
+
+    def tot_mcts(self, x, k, T, vth, iterations=None, time_budget=None, exploration=1.4, virtual_loss=1.0, progress=None):
+        # up to max_concurrency rollouts (the search's share of them under solve_many) run at
+        # once on a thread pool; a retry runs more iterations on the statistics gathered so far
+        progress = progress or SearchProgress(x)
+        search = self.mcts_search(progress, k, T, vth, exploration, virtual_loss)
+        best = search.run(x, iterations, time_budget, max_workers=search_workers(self.max_concurrency), exclude=progress.exhausted)
+        return self.answer(progress, best)
+
+    def mcts_search(self, progress, k, T, vth, exploration, virtual_loss):
+        if progress.mcts is None:
+            progress.mcts = MonteCarloTreeSearch(self, k, T, vth, exploration, virtual_loss, progress=progress)
+            if progress.mcts_state is not None:
+                progress.mcts.restore(progress.mcts_state)
+        return progress.mcts
+
+    async def asolve(self, x, k, T, b, vth, timeout=None, max_expansions=None, heuristic=None, iterations=None, time_budget=None, checkpoint=None, trace=None):
+        search = self.search_function(x, k, T, b, vth, max_expansions, heuristic, iterations, time_budget, asynchronous=True)
+        return await self.arun_search(x, search, timeout, checkpoint, trace, dict(k=k, T=T, b=b, vth=vth, max_expansions=max_expansions, iterations=iterations, time_budget=time_budget))
+
+    async def asolve_iter(self, x, k, T, b, vth, timeout=None, **options):
+        """Async form of solve_iter: runs asolve as a task, and closing the iterator cancels it."""
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        stop = threading.Event()
+
+        def put(event):
+            # model calls may run on executor threads
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        async def run():
+            with search_listener(put, stop):
+                try:
+                    put({"type": "result", "result": await self.asolve(x, k, T, b, vth, timeout, **options)})
+                except (SearchStopped, asyncio.CancelledError):
+                    pass
+                except BaseException as e:
+                    put({"type": "error", "error": e})
+                finally:
+                    put(None)
+
+        task = asyncio.ensure_future(run())
+        best = None
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                streamed, best = self.stream_event(event, best)
+                for event in streamed:
+                    yield event
+        finally:
+            stop.set()
+            task.cancel()
+
+    async def asolve_many(self, problems, k, T, b, vth, timeout=None, max_problems=None, scheduler=None, return_exceptions=False, **options):
+        """Async form of solve_many: the problems run as tasks on the current event loop."""
+        scheduler = scheduler or FairScheduler(self.max_concurrency)
+        max_problems = max_problems or 2 * self.max_concurrency
+        problems = enumerate(problems)
+
+        async def run(index, x):
+            solve_options = options
+            if callable(options.get("checkpoint")):
+                solve_options = dict(options, checkpoint=options["checkpoint"](index, x))
+            with scheduled(scheduler, index):
+                try:
+                    return index, await self.asolve(x, k, T, b, vth, timeout, **solve_options)
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    return index, e
+
+        pending = set()
+        try:
+            while True:
+                for index, x in itertools.islice(problems, max_problems - len(pending)):
+                    pending.add(asyncio.ensure_future(run(index, x)))
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def atot_bfs(self, x, k, T, b, progress=None):
+        # every state of a level is expanded at once, so a level costs about one round-trip
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def expand(s, t):
+            async with semaphore:
+                return s, await self.agenerate_thoughts(s, k, t)
+
+        progress = progress or SearchProgress(x)
+        S0 = [progress.root]
+        for t in range(1, T + 1):
+            # recorded as each expansion returns, as in tot_bfs
+            level = [child for s in S0 if progress.expanded(s) is not None for child in progress.expanded(s)]
+            for expansion in asyncio.as_completed([expand(s, t) for s in S0 if progress.expanded(s) is None]):
+                s, thoughts = await expansion
+                level += progress.add_expansions([(s, thoughts)], lambda states: self.merge_states(states, level))[s]
+            S0_t = self.level_states(progress, S0)
+            Vt = await progress.ascores(S0_t, lambda states: self.aevaluate_states(states, t))
+            St = self.select_beam(S0_t, Vt, b)
+            emit("level", depth=t, states=len(S0_t), beam=len(St), best_value=Vt[St[0]] if St else None)
+            if not St:
+                return None
+            S0 = St
+        return await self.aanswer(progress, max(St, key=lambda s: Vt[s]))
+
+    async def atot_dfs(self, x, k, T, vth, pruning_threshold=0.5, confidence_threshold=0.9, max_iterations=10, convergence_threshold=0.1, convergence_count=5, progress=None):
+        output = []
+        iteration_count = 0
+        consecutive_convergence_count = 0
+        prev_best_value = None
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        progress = progress or SearchProgress(x)
+        retrying = progress.attempts > 1
+
+        async def evaluate(s_prime, t):
+            async with semaphore:
+                return await self.aevaluate_state(s_prime, t)
+
+        async def generate(s, k, t):
+            return await self.agenerate_thoughts(s, k, t)
+
+        prefetched = {}
+
+        def eligible(value):
+            return value > vth and (pruning_threshold is None or retrying or value >= pruning_threshold)
+
+        async def expand(s, t):
+            children = progress.expanded(s)
+            if children is None:
+                task = prefetched.pop(s.index, None)
+                thoughts = await task if task is not None else await generate(s, k, t)
+                children = progress.add_expansions([(s, thoughts)], self.merge_states)[s]
+            return children
+
+        async def score(children, t):
+            return await progress.ascores(children, lambda states: evaluate_all(states, t))
+
+        async def evaluate_all(states, t):
+            if not self.prefetch:
+                return await self.aevaluate_states(states, t)
+
+            async def scored(child):
+                return child, await evaluate(child, t)
+
+            values = {}
+            prefetching = t >= T
+            for future in asyncio.as_completed([scored(child) for child in states]):
+                child, values[child] = await future
+                if not prefetching and eligible(values[child]) and progress.expanded(child) is None:
+                    prefetched[child.index] = asyncio.ensure_future(generate(child, k, t + 1))
+                    prefetching = True
+            return values
+
+        async def dfs(s, t):
+            nonlocal consecutive_convergence_count, prev_best_value, iteration_count
+            if t > T:
+                thought, values = await asyncio.gather(self.aanswer(progress, s), progress.ascores([s], lambda states: evaluate_each(states, t)))
+                value = values[s]
+                output.append((thought, value))
+
+                if confidence_threshold is not None and value >= confidence_threshold:
+                    return True
+
+                if prev_best_value is not None and convergence_threshold is not None:
+                    if abs(value - prev_best_value) < convergence_threshold:
+                        consecutive_convergence_count += 1
+                    else:
+                        consecutive_convergence_count = 0
+
+                prev_best_value = value
+                iteration_count += 1
+
+                if (max_iterations is not None and iteration_count >= max_iterations) or (convergence_count is not None and consecutive_convergence_count >= convergence_count):
+                    return True
+
+                return False
+
+            if self.batch_siblings or self.prefetch:
+                children = await expand(s, t)
+                values = await score(children, t)
+                for s_prime in sorted(children, key=lambda child: values[child], reverse=True):
+                    if eligible(values[s_prime]) and await dfs(s_prime, t + 1):
+                        return True
+                return False
+
+            # siblings are scored concurrently, then visited in the same order as tot_dfs
+            candidates = progress.expanded(s)
+            if candidates is None:
+                candidates = progress.add_expansions([(s, sorted(await generate(s, k, t)))], self.merge_states)[s]
+            values = await progress.ascores(candidates, lambda states: evaluate_each(states, t))
+            for s_prime in candidates:
+                if eligible(values[s_prime]):
+                    if await dfs(s_prime, t + 1):
+                        return True
+
+            return False
+
+        async def evaluate_each(states, t):
+            return dict(zip(states, await asyncio.gather(*(evaluate(s_prime, t) for s_prime in states))))
+
+        try:
+            await dfs(progress.root, 1)
+        finally:
+            for task in prefetched.values():
+                task.cancel()
+        return max(output, key=lambda x: x[1]) if output else None
+
+    async def atot_best_first(self, x, k, T, vth, max_expansions=None, heuristic=None, progress=None):
+        progress = progress or SearchProgress(x)
+        frontier = self.best_first_frontier(progress, vth, T, heuristic)
+        expansions = 0
+        best = None
+        while frontier:
+            entry = heapq.heappop(frontier)
+            s = entry[2]
+            if s.depth >= T:
+                best = s
+                break
+            if max_expansions is not None and expansions >= max_expansions:
+                heapq.heappush(frontier, entry)
+                break
+            expansions += 1
+            t = s.depth + 1
+            children = progress.expanded(s)
+            if children is None:
+                children = progress.add_expansions([(s, await self.agenerate_thoughts(s, k, t))], self.merge_states)[s]
+            Vt = await progress.ascores(children, lambda states: self.aevaluate_states(states, t))
+            self.push_children(frontier, progress.order, children, Vt, vth, T, heuristic)
+        if best is None:
+            best = self.best_evaluated(progress)
+        if best is None:
+            return None
+        return await self.aanswer(progress, best)
+
+    async def atot_mcts(self, x, k, T, vth, iterations=None, time_budget=None, exploration=1.4, virtual_loss=1.0, progress=None):
+        progress = progress or SearchProgress(x)
+        search = self.mcts_search(progress, k, T, vth, exploration, virtual_loss)
+        best = await search.arun(x, iterations, time_budget, max_workers=self.max_concurrency, exclude=progress.exhausted)
+        return await self.aanswer(progress, best)
+
 
 class OptimizedTreeofThoughts(TreeofThoughts):
-    def solve(self, x, k, T, b, vth, timeout=None, confidence_threshold=0.9, max_iterations=10, convergence_threshold=0.1, convergence_count=5):
-        start_time = time.time()
-        if self.search_algorithm == 'BFS':
-            while timeout is None or time.time() - start_time < timeout:
-                result = self.tot_bfs(x, k, T, b)
-                if result:
-                    return result
-        elif self.search_algorithm == 'DFS':
-            while timeout is None or time.time() - start_time < timeout:
-                result = self.tot_dfs(x, k, T, vth, confidence_threshold=confidence_threshold, max_iterations=max_iterations, convergence_threshold=convergence_threshold, convergence_count=convergence_count)
-                if result:
-                    return result
-        else:
-            raise ValueError("Invalid search algorithm. Choose 'BFS' or 'DFS'.")
+    """
+    TreeofThoughts with a dynamic BFS beam: after every level the beam shrinks when a few states
+    clearly score best and widens (up to max_beam, 2b by default) when the scores are flat.
+    level_budget caps the number of states expanded per level, i.e. generate calls per level.
+    """
+
+    def __init__(self, model, search_algorithm, max_concurrency=16, min_beam=1, max_beam=None, level_budget=None, beam_temperature=0.1, batch_siblings=False, prefetch=False, transpositions=None, diversity_threshold=None):
+        super().__init__(model, search_algorithm, max_concurrency, batch_siblings, prefetch, transpositions, diversity_threshold)
+        self.min_beam = min_beam
+        self.max_beam = max_beam
+        self.level_budget = level_budget
+        self.beam_temperature = beam_temperature
+
+    def beam_width(self, values, b):
+        # effective number of candidates (inverse Simpson index) of a softmax over the scores:
+        # about 1 when one state stands out, the whole level when all score alike
+        max_beam = self.max_beam or 2 * b
+        if self.level_budget is not None:
+            max_beam = min(max_beam, self.level_budget)
+        if not values:
+            return max(1, min(b, max_beam))
+        top = max(values)
+        weights = [math.exp((value - top) / self.beam_temperature) for value in values]
+        effective = sum(weights) ** 2 / sum(weight * weight for weight in weights)
+        return max(1, min(max_beam, max(self.min_beam, round(effective))))
+
+    def select_beam(self, states, values, b):
+        width = self.beam_width([values[s] for s in states], b)
+        return sorted(states, key=lambda s: values[s], reverse=True)[:width]
+
+    def solve(self, x, k, T, b, vth, timeout=None, confidence_threshold=0.9, max_iterations=10, convergence_threshold=0.1, convergence_count=5, max_expansions=None, heuristic=None, iterations=None, time_budget=None, checkpoint=None, trace=None):
+        dfs_options = dict(confidence_threshold=confidence_threshold, max_iterations=max_iterations, convergence_threshold=convergence_threshold, convergence_count=convergence_count)
+        search = self.search_function(x, k, T, b, vth, max_expansions, heuristic, iterations, time_budget, dfs_options)
+        return self.run_search(x, search, timeout, checkpoint, trace, dict(k=k, T=T, b=b, vth=vth, **dfs_options, max_expansions=max_expansions, iterations=iterations, time_budget=time_budget))
+
+    async def asolve(self, x, k, T, b, vth, timeout=None, confidence_threshold=0.9, max_iterations=10, convergence_threshold=0.1, convergence_count=5, max_expansions=None, heuristic=None, iterations=None, time_budget=None, checkpoint=None, trace=None):
+        dfs_options = dict(confidence_threshold=confidence_threshold, max_iterations=max_iterations, convergence_threshold=convergence_threshold, convergence_count=convergence_count)
+        search = self.search_function(x, k, T, b, vth, max_expansions, heuristic, iterations, time_budget, dfs_options, asynchronous=True)
+        return await self.arun_search(x, search, timeout, checkpoint, trace, dict(k=k, T=T, b=b, vth=vth, **dfs_options, max_expansions=max_expansions, iterations=iterations, time_budget=time_budget))
 
 if __name__ == '__main__':
     search_algorithm = "DFS"